@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Compare PDF rasterizer backends on the benchmark corpus.
+
+Each corpus diagram is compiled once with xelatex, then every installed
+rasterizer converts the resulting PDF ``--repeat`` times. Results are printed
+as a table and optionally written as JSON.
+
+    python3 benchmarks/bench_rasterizers.py --repeat 5 --output raster.json
+"""
+
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import click
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from rasterizers import RASTERIZERS, available_rasterizers  # noqa: E402
+from tikz_http_server import build_latex_document  # noqa: E402
+
+CORPUS_DIR = Path(__file__).resolve().parent / "corpus"
+
+
+def compile_corpus(names: list[str], work_dir: Path) -> dict[str, Path]:
+    pdfs = {}
+    for name in names:
+        tex_file = work_dir / f"{name}.tex"
+        tex_file.write_text(
+            build_latex_document((CORPUS_DIR / f"{name}.tex").read_text(encoding="utf-8")),
+            encoding="utf-8",
+        )
+        result = subprocess.run(
+            ["xelatex", "-interaction=nonstopmode", tex_file.name],
+            capture_output=True, text=True, cwd=work_dir,
+        )
+        pdf_file = work_dir / f"{name}.pdf"
+        if result.returncode != 0 or not pdf_file.exists():
+            click.echo(f"skipping {name}: xelatex failed", err=True)
+            continue
+        pdfs[name] = pdf_file
+    return pdfs
+
+
+@click.command()
+@click.option("--rasterizer", "backends", multiple=True, help="Backend to benchmark (default: all installed)")
+@click.option("--corpus", "names", multiple=True, help="Corpus entry to use (default: all)")
+@click.option("--repeat", default=5, help="Conversions per backend and diagram")
+@click.option("--dpi", default=300, help="Rasterization resolution")
+@click.option("--image-format", default="png", help="Output image format")
+@click.option("--output", type=click.Path(dir_okay=False), help="Write results as JSON")
+def main(backends, names, repeat, dpi, image_format, output) -> int:
+    backends = list(backends) or available_rasterizers()
+    backends = [name for name in backends if image_format in RASTERIZERS[name].formats]
+    names = list(names) or sorted(path.stem for path in CORPUS_DIR.glob("*.tex"))
+    if not backends:
+        click.echo("No rasterizer installed", err=True)
+        return 1
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = Path(temp_dir)
+        pdfs = compile_corpus(names, work_dir)
+        for name, pdf_file in pdfs.items():
+            for backend in backends:
+                rasterizer = RASTERIZERS[backend]
+                output_file = work_dir / f"{name}-{backend}.{image_format}"
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    rasterizer.rasterize(pdf_file, output_file, dpi=dpi, image_format=image_format)
+                    timings.append(time.perf_counter() - start)
+                results.append({
+                    "diagram": name,
+                    "rasterizer": backend,
+                    "median_ms": statistics.median(timings) * 1000,
+                    "min_ms": min(timings) * 1000,
+                    "bytes": output_file.stat().st_size,
+                })
+
+    click.echo(f"{'diagram':<18}{'rasterizer':<14}{'median ms':>12}{'min ms':>10}{'bytes':>12}")
+    for row in results:
+        click.echo(
+            f"{row['diagram']:<18}{row['rasterizer']:<14}"
+            f"{row['median_ms']:>12.1f}{row['min_ms']:>10.1f}{row['bytes']:>12}"
+        )
+
+    if output:
+        Path(output).write_text(
+            json.dumps({"dpi": dpi, "image_format": image_format, "results": results}, indent=2),
+            encoding="utf-8",
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
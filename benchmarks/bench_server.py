@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""Load-test the render server on the benchmark corpus.
+
+Against a running server, ``--url`` drives the ``/mcp`` streamable HTTP
+endpoint with ``--concurrency`` client sessions. Without it the harness
+builds a ``TikZHTTPServer`` in this process and calls its render methods
+through the render pool, which isolates the render pipeline from the HTTP
+and MCP layers.
+
+Every corpus entry is rendered ``--repeat`` times in shuffled order. By
+default a unique comment is appended to each input so every request misses
+the cache; ``--no-cache-busting`` measures cache hits instead. The report
+(JSON with sorted keys, easy to diff across runs) contains throughput,
+p50/p95/p99 latency, mean per-stage timings, peak RSS and output bytes,
+overall and per corpus entry.
+
+    python3 benchmarks/bench_server.py --concurrency 8 --repeat 10 --output in-process.json
+    python3 benchmarks/bench_server.py --url http://localhost:3000/mcp --server-pid 1234 --output http.json
+"""
+
+import asyncio
+import base64
+import contextlib
+import json
+import logging
+import random
+import resource
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import click
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import metrics  # noqa: E402
+
+CORPUS_DIR = Path(__file__).resolve().parent / "corpus"
+
+TOOLS = ("render_tikz_url", "render_tikz_base64")
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    """Linearly interpolated ``q``-th percentile (0-100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(samples: list[dict], wall_seconds: float | None = None) -> dict:
+    """Aggregate per-request samples into latency, stage and size statistics."""
+    latencies = [sample["latency_ms"] for sample in samples if sample["ok"]]
+    stages: dict[str, list[float]] = {}
+    for sample in samples:
+        for stage, ms in sample["timings_ms"].items():
+            stages.setdefault(stage, []).append(ms)
+    sizes = [sample["bytes"] for sample in samples if sample["bytes"] is not None]
+    summary = {
+        "requests": len(samples),
+        "errors": sum(1 for sample in samples if not sample["ok"]),
+        "latency_ms": {
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies) if latencies else None,
+        },
+        "stage_mean_ms": {stage: sum(values) / len(values) for stage, values in stages.items()},
+        "output_bytes": {
+            "total": sum(sizes),
+            "mean": sum(sizes) / len(sizes) if sizes else None,
+        },
+    }
+    if wall_seconds is not None:
+        summary["wall_seconds"] = wall_seconds
+        summary["throughput_rps"] = len(samples) / wall_seconds if wall_seconds else None
+    return summary
+
+
+def load_corpus(names: list[str]) -> dict[str, str]:
+    names = names or sorted(path.stem for path in CORPUS_DIR.glob("*.tex"))
+    return {name: (CORPUS_DIR / f"{name}.tex").read_text(encoding="utf-8") for name in names}
+
+
+def build_jobs(corpus: dict[str, str], repeat: int, cache_busting: bool, seed: int) -> list[tuple[str, str]]:
+    jobs = []
+    for name, code in corpus.items():
+        for _ in range(repeat):
+            # 注释不影响输出，但会改变缓存键
+            jobs.append((name, f"{code}\n% bench {uuid.uuid4().hex}" if cache_busting else code))
+    random.Random(seed).shuffle(jobs)
+    return jobs
+
+
+def peak_rss_bytes(pid: int | None) -> int | None:
+    """Peak RSS of ``pid`` (VmHWM), or of this process and its children."""
+    if pid is not None:
+        try:
+            for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+        except OSError:
+            return None
+        return None
+    # Linux 上 ru_maxrss 的单位是 KB；子进程取其中峰值最大的一个
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    return max(own, children)
+
+
+async def run_jobs(jobs: list[tuple[str, str]], concurrency: int, client) -> tuple[list[dict], float]:
+    """Run ``jobs`` on ``concurrency`` clients; ``client()`` yields a render function."""
+    queue: asyncio.Queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+    samples: list[dict] = []
+
+    async def drain() -> None:
+        # 客户端在各自的任务内打开和关闭（anyio 的取消作用域要求如此）
+        async with client() as render:
+            while not queue.empty():
+                name, code = queue.get_nowait()
+                samples.append({"diagram": name, **await render(code)})
+
+    started = time.perf_counter()
+    await asyncio.gather(*(drain() for _ in range(concurrency)))
+    return samples, time.perf_counter() - started
+
+
+@contextlib.asynccontextmanager
+async def in_process_client(server, tool: str, output_format: str):
+    """Render through ``server.render_pool`` like the tool handlers do."""
+    compile_func = server.compile_tikz_to_url if tool == "render_tikz_url" else server.compile_tikz_to_image
+
+    def file_size(file_url: str) -> int:
+        return server.render_cache.path_for(file_url.rsplit("/", 1)[1]).stat().st_size
+
+    async def render(code: str) -> dict:
+        # 每个 asyncio 任务有自己的上下文，渲染线程会继承它
+        timings = metrics.track_request()
+        start = time.perf_counter()
+        try:
+            result = await server.render_pool.run(compile_func, code, output_format)
+        except Exception as e:
+            return _sample(start, False, timings, None, error=type(e).__name__)
+        end = time.perf_counter()
+        if tool == "render_tikz_url":
+            size = file_size(result)
+        else:
+            image_base64, file_url = result
+            size = len(base64.b64decode(image_base64)) if image_base64 else file_size(file_url)
+        return _sample(start, True, timings, size, end=end)
+
+    yield render
+
+
+@contextlib.asynccontextmanager
+async def mcp_client(url: str, tool: str, output_format: str, http: httpx.AsyncClient):
+    """Render through the ``/mcp`` endpoint over one MCP session."""
+    from mcp import ClientSession
+    from mcp.client.streamable_http import streamablehttp_client
+
+    async with streamablehttp_client(url) as (read, write, _):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+
+            async def render(code: str) -> dict:
+                start = time.perf_counter()
+                result = await session.call_tool(
+                    tool,
+                    {"tikz_code": code, "output_format": output_format, "include_timings": True},
+                )
+                end = time.perf_counter()
+                ok, timings, size, file_url = _parse_tool_result(result.content)
+                if ok and size is None and file_url:
+                    # 响应里只有链接时，用 HEAD 取大小，不计入延迟
+                    try:
+                        response = await http.head(file_url, follow_redirects=True)
+                        size = int(response.headers.get("content-length", 0)) or None
+                    except httpx.HTTPError:
+                        size = None
+                sample = _sample(start, ok, {}, size, end=end)
+                sample["timings_ms"] = timings
+                if not ok:
+                    sample["error"] = result.content[0].text.split(":", 1)[0] if result.content else "empty"
+                return sample
+
+            yield render
+
+
+async def bench_http(url: str, jobs, concurrency: int, tool: str, output_format: str):
+    async with httpx.AsyncClient(timeout=60) as http:
+        return await run_jobs(jobs, concurrency, lambda: mcp_client(url, tool, output_format, http))
+
+
+async def bench_in_process(server_options: dict, jobs, concurrency: int, tool: str, output_format: str):
+    from tikz_http_server import TikZHTTPServer
+
+    server = TikZHTTPServer(**server_options)
+    try:
+        return await run_jobs(jobs, concurrency, lambda: in_process_client(server, tool, output_format))
+    finally:
+        server.render_pool.shutdown(wait=False)
+        server.warm_pool.shutdown()
+        server.image_store.close()
+
+
+def _parse_tool_result(content: list) -> tuple[bool, dict, int | None, str | None]:
+    ok, timings, size, file_url = False, {}, None, None
+    for item in content:
+        if item.type == "text":
+            if item.text.startswith("{"):
+                timings = json.loads(item.text).get("timings_ms", timings)
+            elif "rendered successfully" in item.text:
+                ok = True
+                if "URL: " in item.text:
+                    file_url = item.text.rsplit("URL: ", 1)[1].strip()
+        elif item.type == "image":
+            size = len(base64.b64decode(item.data))
+        elif item.type == "resource" and hasattr(item.resource, "blob"):
+            size = len(base64.b64decode(item.resource.blob))
+        elif item.type == "resource_link":
+            file_url = str(item.uri)
+    timings.pop("total", None)
+    return ok, timings, size, file_url
+
+
+def _sample(start: float, ok: bool, timings: dict, size: int | None, error: str | None = None, end: float | None = None) -> dict:
+    sample = {
+        "ok": ok,
+        "latency_ms": ((end or time.perf_counter()) - start) * 1000,
+        "timings_ms": {stage: seconds * 1000 for stage, seconds in timings.items()},
+        "bytes": size if ok else None,
+    }
+    if error:
+        sample["error"] = error
+    return sample
+
+
+@click.command()
+@click.option("--url", default=None, help="MCP endpoint of a running server (default: render in-process)")
+@click.option("--server-pid", type=int, default=None, help="PID of the server, to report its peak RSS in --url mode")
+@click.option("--tool", default="render_tikz_url", type=click.Choice(TOOLS), help="Tool to call")
+@click.option("--output-format", default="png", help="output_format of every request")
+@click.option("--corpus", "names", multiple=True, help="Corpus entry to use (default: all)")
+@click.option("--repeat", default=5, help="Requests per corpus entry")
+@click.option("--concurrency", default=4, help="Concurrent clients")
+@click.option("--cache-busting/--no-cache-busting", default=True, help="Make every request a cache miss")
+@click.option("--seed", default=0, help="Seed for the request order")
+@click.option("--workers", default=None, type=int, help="In-process mode: render pool size")
+@click.option("--warm-workers", default=2, help="In-process mode: warm xelatex processes")
+@click.option("--rasterizer", default="auto", help="In-process mode: PDF rasterizer")
+@click.option("--output", type=click.Path(dir_okay=False), help="Write the report as JSON")
+def main(url, server_pid, tool, output_format, names, repeat, concurrency, cache_busting, seed,
+         workers, warm_workers, rasterizer, output) -> int:
+    logging.basicConfig(level=logging.WARNING)
+    corpus = load_corpus(list(names))
+    jobs = build_jobs(corpus, repeat, cache_busting, seed)
+
+    if url:
+        samples, wall_seconds = asyncio.run(bench_http(url, jobs, concurrency, tool, output_format))
+    else:
+        server_options = {
+            "workers": workers,
+            "max_queue": max(len(jobs), 32),
+            "warm_workers": warm_workers,
+            "rasterizer": rasterizer,
+        }
+        samples, wall_seconds = asyncio.run(
+            bench_in_process(server_options, jobs, concurrency, tool, output_format)
+        )
+
+    report = {
+        "config": {
+            "mode": "http" if url else "in-process",
+            "url": url,
+            "tool": tool,
+            "output_format": output_format,
+            "repeat": repeat,
+            "concurrency": concurrency,
+            "cache_busting": cache_busting,
+            "corpus": sorted(corpus),
+        },
+        "summary": {
+            **summarize(samples, wall_seconds),
+            "peak_rss_bytes": peak_rss_bytes(server_pid if url else None),
+        },
+        "diagrams": {
+            name: summarize([sample for sample in samples if sample["diagram"] == name])
+            for name in sorted(corpus)
+        },
+    }
+
+    summary = report["summary"]
+    click.echo(
+        f"{summary['requests']} requests, {summary['errors']} errors, "
+        f"{summary['throughput_rps']:.2f} req/s over {wall_seconds:.1f}s"
+    )
+    click.echo(f"{'diagram':<18}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'bytes':>12}")
+    for name, row in report["diagrams"].items():
+        latency = row["latency_ms"]
+        mean_bytes = row["output_bytes"]["mean"]
+        click.echo(
+            f"{name:<18}{row['errors']:>8}"
+            + "".join(f"{latency[q]:>10.1f}" if latency[q] is not None else f"{'-':>10}" for q in ("p50", "p95", "p99"))
+            + (f"{mean_bytes:>12.0f}" if mean_bytes is not None else f"{'-':>12}")
+        )
+
+    if output:
+        Path(output).write_text(json.dumps(report, indent=2, sort_keys=True), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -72,9 +72,7 @@ docker-compose -f docker-compose.minimal.yml up -d ${BUILD_FLAG}
 # 等待服务启动
 echo "⏳ 等待服务启动..."
 for i in {1..30}; do
-    if curl -s -X POST http://localhost:${PORT}/mcp \
-      -H "Content-Type: application/json" \
-      -d '{"method":"tools/list","params":{}}' > /dev/null 2>&1; then
+    if curl -sf http://localhost:${PORT}/health > /dev/null 2>&1; then
         echo "✅ 服务启动成功！"
         break
     fi
@@ -91,7 +89,7 @@ echo ""
 echo "🎉 最小化镜像部署完成！"
 echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
 echo "✅ 服务地址: http://localhost:${PORT}/mcp"
-echo "✅ 健康检查: http://localhost:${PORT}/mcp"
+echo "✅ 健康检查: http://localhost:${PORT}/health"
 echo ""
 echo "📋 MCP客户端配置："
 echo "{"
@@ -0,0 +1,314 @@
+import contextvars
+import importlib.util
+import logging
+import math
+import re
+import shutil
+import subprocess
+from pathlib import Path
+from typing import NamedTuple
+
+import sandbox
+from sandbox import RenderCancelled, SandboxLimits
+
+logger = logging.getLogger(__name__)
+
+# 请求可指定的分辨率和尺寸范围，避免生成巨大的位图
+MIN_DPI = 10
+MAX_DPI = 1200
+MAX_PIXELS = 10000
+MIN_THUMBNAIL_WIDTH = 16
+MAX_THUMBNAIL_WIDTH = 2048
+
+# 颜色数不超过该值的位图视为线稿，可以量化为调色板；渐变和照片保持真彩色
+LINE_ART_MAX_COLORS = 8192
+
+# oxipng 的优化级别（0-6），2 在耗时和压缩率之间比较均衡
+OXIPNG_LEVEL = 2
+
+# pdfinfo 输出中的页面尺寸，单位为 pt；指定多页时每行为 "Page    N size: ..."
+PAGE_SIZE = re.compile(r"^Page\s+(?:\d+\s+)?size:\s+([\d.]+) x ([\d.]+) pts", re.MULTILINE)
+
+# 当前请求的输出大小统计；RenderPool 会把上下文带到工作线程
+_request_stats: contextvars.ContextVar[dict | None] = contextvars.ContextVar(
+    "image_stats", default=None
+)
+
+
+class ImageOptions(NamedTuple):
+    """Per-request bitmap size; unset fields fall back to the server defaults.
+
+    ``width`` and ``height`` bound the output in pixels, keeping the aspect
+    ratio; when given they take precedence over ``dpi``.
+    """
+
+    dpi: int | None = None
+    width: int | None = None
+    height: int | None = None
+
+    @classmethod
+    def from_arguments(cls, arguments: dict) -> "ImageOptions":
+        """Read and validate ``dpi``/``width``/``height`` tool arguments; raise ValueError."""
+        return cls(
+            dpi=_int_argument(arguments, "dpi", MIN_DPI, MAX_DPI),
+            width=_int_argument(arguments, "width", 1, MAX_PIXELS),
+            height=_int_argument(arguments, "height", 1, MAX_PIXELS),
+        )
+
+
+def thumbnail_width_argument(arguments: dict) -> int | None:
+    return _int_argument(arguments, "thumbnail_width", MIN_THUMBNAIL_WIDTH, MAX_THUMBNAIL_WIDTH)
+
+
+def _int_argument(arguments: dict, name: str, minimum: int, maximum: int) -> int | None:
+    value = arguments.get(name)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or not minimum <= value <= maximum:
+        raise ValueError(f"{name} must be an integer between {minimum} and {maximum}")
+    return value
+
+
+class OptimizeResult(NamedTuple):
+    """Sizes of one image before and after post-processing."""
+
+    original_bytes: int
+    bytes: int
+    width: int | None = None
+    height: int | None = None
+
+
+def track_request() -> dict:
+    """Start collecting output sizes for the current request (task) and return them."""
+    stats: dict = {}
+    _request_stats.set(stats)
+    return stats
+
+
+def record(result: OptimizeResult) -> None:
+    """Add ``result`` to the current request's output size statistics."""
+    stats = _request_stats.get()
+    if stats is None:
+        return
+    # 批量渲染时累加所有图片的大小
+    stats["files"] = stats.get("files", 0) + 1
+    stats["original_bytes"] = stats.get("original_bytes", 0) + result.original_bytes
+    stats["bytes"] = stats.get("bytes", 0) + result.bytes
+    if stats["original_bytes"]:
+        stats["saved_percent"] = round(100 * (1 - stats["bytes"] / stats["original_bytes"]), 1)
+    if result.width is not None:
+        stats["width"], stats["height"] = result.width, result.height
+
+
+def pdf_page_sizes(
+    pdf_path: Path, limits: SandboxLimits, pages: int = 1
+) -> list[tuple[float, float]] | None:
+    """Sizes of the first ``pages`` pages of ``pdf_path`` in pt, using poppler's pdfinfo."""
+    if shutil.which("pdfinfo") is None:
+        return None
+    try:
+        result = sandbox.run(
+            ["pdfinfo", "-f", "1", "-l", str(pages), str(pdf_path)], limits, text=True
+        )
+    except subprocess.CalledProcessError:
+        return None
+    sizes = [(float(width), float(height)) for width, height in PAGE_SIZE.findall(result.stdout)]
+    if len(sizes) != pages:
+        return None
+    return sizes
+
+
+def raster_dpi(
+    pdf_path: Path, options: ImageOptions, default_dpi: int, limits: SandboxLimits
+) -> int:
+    """DPI at which to rasterize ``pdf_path`` so it fills the requested box.
+
+    Without a target size this is the requested or default DPI. If the page
+    size is unknown, the default DPI is used and ``ImageOptimizer`` scales
+    the bitmap down to the box afterwards.
+    """
+    return raster_dpis(pdf_path, options, default_dpi, limits, pages=1)[0]
+
+
+def raster_dpis(
+    pdf_path: Path, options: ImageOptions, default_dpi: int, limits: SandboxLimits, pages: int
+) -> list[int]:
+    """``raster_dpi`` for each of the first ``pages`` pages of ``pdf_path``."""
+    dpi = options.dpi or default_dpi
+    if options.width is None and options.height is None:
+        return [dpi] * pages
+    sizes = pdf_page_sizes(pdf_path, limits, pages)
+    if sizes is None:
+        return [dpi] * pages
+    return [_fit_dpi(size, options, dpi) for size in sizes]
+
+
+def _fit_dpi(page_size: tuple[float, float], options: ImageOptions, dpi: int) -> int:
+    if min(page_size) <= 0:
+        return dpi
+    # 按宽高中限制更严的一边计算，向上取整后由 ImageOptimizer 精确缩小
+    scales = [
+        target * 72 / size
+        for target, size in zip((options.width, options.height), page_size)
+        if target is not None
+    ]
+    return max(MIN_DPI, min(MAX_DPI, math.ceil(min(scales))))
+
+
+class ImageOptimizer:
+    """Shrinks rasterized diagrams before they are stored.
+
+    Bitmaps are scaled down to the requested box. PNGs are then re-encoded
+    with the best zlib settings; line art (few distinct colours) is also
+    tried as a palette image, losslessly when it has at most 256 colours and
+    quantized to ``png_colors`` otherwise. The smallest candidate is passed
+    through oxipng (the ``pyoxipng`` module or the ``oxipng`` binary) when
+    installed. An image is only replaced when the result is smaller.
+    Everything except oxipng needs Pillow; without it images are kept as
+    rasterized.
+    """
+
+    def __init__(
+        self, enabled: bool = True, png_colors: int = 256, limits: SandboxLimits | None = None
+    ):
+        self.enabled = enabled
+        self.png_colors = png_colors
+        self.limits = limits or SandboxLimits()
+        self.has_pillow = importlib.util.find_spec("PIL") is not None
+        self.oxipng = None
+        if importlib.util.find_spec("oxipng") is not None:
+            self.oxipng = "module"
+        elif shutil.which("oxipng") is not None:
+            self.oxipng = "binary"
+        if enabled:
+            logger.info(
+                f"Image optimizer: pillow={self.has_pillow}, oxipng={self.oxipng or 'none'}, "
+                f"png_colors={png_colors}"
+            )
+
+    def cache_options(self) -> dict:
+        """Settings that change the optimized bytes, part of the cache key."""
+        if not self.enabled:
+            return {"optimize": False}
+        return {
+            "optimize": True,
+            "png_colors": self.png_colors if self.has_pillow else None,
+            "oxipng": OXIPNG_LEVEL if self.oxipng else None,
+        }
+
+    def process(self, image_file: Path, image_format: str, options: ImageOptions) -> OptimizeResult:
+        """Fit ``image_file`` into the requested box and compress it in place."""
+        original_bytes = image_file.stat().st_size
+        width = height = None
+        if self.has_pillow:
+            width, height = self._fit(image_file, image_format, options.width, options.height)
+        if self.enabled and image_format == "png":
+            self._optimize_png(image_file)
+        return OptimizeResult(original_bytes, image_file.stat().st_size, width, height)
+
+    def thumbnail(self, source: Path, output: Path, image_format: str, width: int) -> OptimizeResult:
+        """Write a copy of ``source`` scaled down to ``width`` pixels to ``output``."""
+        if not self.has_pillow:
+            raise RuntimeError("Thumbnails require Pillow (pip install pillow)")
+        shutil.copyfile(source, output)
+        return self.process(output, image_format, ImageOptions(width=width))
+
+    def _fit(
+        self, image_file: Path, image_format: str, width: int | None, height: int | None
+    ) -> tuple[int, int]:
+        from PIL import Image
+
+        with Image.open(image_file) as image:
+            image.load()
+        size = image.size
+        scale = min(
+            [target / current for target, current in zip((width, height), size) if target is not None],
+            default=1.0,
+        )
+        # 只缩小不放大；放大在光栅化时通过提高 DPI 完成
+        if scale >= 1.0:
+            return size
+        size = (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+        if image.mode in ("P", "1"):
+            # Pillow 对调色板和黑白图片只能用最近邻缩放，会丢失抗锯齿和细线；
+            # 先转为真彩色，PNG 随后由 _optimize_png 重新量化
+            image = image.convert("RGBA")
+        image = image.resize(size, Image.Resampling.LANCZOS)
+        self._save(image, image_file, image_format)
+        return size
+
+    def _save(self, image, path: Path, image_format: str) -> None:
+        if image_format == "jpeg":
+            image.convert("RGB").save(path, format="JPEG", quality=90, optimize=True)
+        elif image_format == "webp":
+            image.save(path, format="WEBP", quality=90, method=6)
+        else:
+            image.save(path, format="PNG", optimize=True)
+
+    def _optimize_png(self, image_file: Path) -> None:
+        candidates = []
+        if self.has_pillow:
+            candidates = self._png_candidates(image_file)
+        best = min(candidates, key=lambda path: path.stat().st_size, default=None)
+        if best is not None and best.stat().st_size < image_file.stat().st_size:
+            best.replace(image_file)
+        for candidate in candidates:
+            candidate.unlink(missing_ok=True)
+        if self.oxipng is not None:
+            self._run_oxipng(image_file)
+
+    def _png_candidates(self, image_file: Path) -> list[Path]:
+        from PIL import Image, ImageChops
+
+        with Image.open(image_file) as image:
+            image.load()
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+
+        truecolor = image_file.with_name(f"{image_file.stem}.truecolor.png")
+        image.save(truecolor, format="PNG", optimize=True)
+        candidates = [truecolor]
+
+        colors = image.getcolors(LINE_ART_MAX_COLORS)
+        if colors is None:
+            return candidates
+        quantized = None
+        if len(colors) <= 256:
+            # 颜色不超过 256 种时先尝试无损调色板；八叉树合并了颜色时不再是无损的
+            quantized = self._quantize(image, len(colors))
+            if ImageChops.difference(quantized.convert(image.mode), image).getbbox() is not None:
+                quantized = None
+        if quantized is None and self.png_colors:
+            quantized = self._quantize(image, self.png_colors)
+        if quantized is None:
+            return candidates
+        palette = image_file.with_name(f"{image_file.stem}.palette.png")
+        quantized.save(palette, format="PNG", optimize=True)
+        candidates.append(palette)
+        return candidates
+
+    @staticmethod
+    def _quantize(image, colors: int):
+        from PIL import Image
+
+        # 线稿不抖动：抖动噪点会降低压缩率，抗锯齿边缘本身已足够平滑
+        return image.quantize(
+            colors=colors, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE
+        )
+
+    def _run_oxipng(self, image_file: Path) -> None:
+        try:
+            if self.oxipng == "module":
+                import oxipng
+
+                oxipng.optimize(str(image_file), level=OXIPNG_LEVEL)
+            else:
+                sandbox.run(
+                    ["oxipng", "-q", "-o", str(OXIPNG_LEVEL), "--strip", "safe", str(image_file)],
+                    self.limits,
+                )
+        except RenderCancelled:
+            raise
+        except Exception as e:
+            # oxipng 只是进一步压缩，失败时保留 Pillow 的结果
+            logger.warning(f"oxipng failed on {image_file.name}: {e}")
@@ -0,0 +1,213 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = ".index.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS images_accessed ON images (accessed);
+"""
+
+
+class ImageStore:
+    """Sharded directory of rendered files with a SQLite index.
+
+    Files are stored as ``<root>/<name[:2]>/<name>`` so no directory grows
+    past a few thousand entries. The index records size, creation and last
+    access time of every file; eviction walks it in LRU order a batch at a
+    time, dropping entries idle for longer than ``ttl`` and then the least
+    recently used ones while the store is over ``max_bytes``. The tree itself
+    is never scanned.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        max_bytes: int = 1024 * 1024 * 1024,
+        ttl: float = 86400.0,
+        batch_size: int = 500,
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # 访问时间先记在内存里，下一次淘汰时批量写入索引
+        self._pending_access: dict[str, float] = {}
+        self._evicted = 0
+
+        index_file = self.root / INDEX_NAME
+        is_new = not index_file.exists()
+        self._db = sqlite3.connect(index_file, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        if is_new:
+            self._import_flat_files()
+        self._total_bytes, self._files = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0), COUNT(*) FROM images"
+        ).fetchone()
+
+    def path_for(self, name: str) -> Path:
+        return self.root / name[:2] / name
+
+    def add(self, name: str, size: int) -> None:
+        """Index a file that was just written to ``path_for(name)``."""
+        now = time.time()
+        with self._lock:
+            self._pending_access.pop(name, None)
+            previous = self._db.execute(
+                "SELECT size FROM images WHERE name = ?", (name,)
+            ).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO images (name, size, created, accessed) VALUES (?, ?, ?, ?)",
+                (name, size, now, now),
+            )
+            if previous is None:
+                self._files += 1
+                self._total_bytes += size
+            else:
+                self._total_bytes += size - previous[0]
+
+    def lookup(self, name: str) -> int | None:
+        """Return the size of a live entry and mark it as used, or None."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, accessed FROM images WHERE name = ?", (name,)
+            ).fetchone()
+            if row is None:
+                return None
+            size, accessed = row
+            accessed = max(accessed, self._pending_access.get(name, 0.0))
+            if now - accessed > self.ttl:
+                return None
+            self._pending_access[name] = now
+            return size
+
+    def forget(self, name: str) -> None:
+        """Drop an entry whose file turned out to be missing."""
+        with self._lock:
+            self._pending_access.pop(name, None)
+            self._delete([name])
+
+    def evict(self) -> int:
+        """Run one incremental eviction step and return the number of files removed."""
+        now = time.time()
+        with self._lock:
+            self._flush_access()
+            # 删除索引和文件期间持有写事务，其他进程的 add 会等待提交后再写入；
+            # 本进程的 add 由 _lock 串行化
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                victims = self._evict_batch(now)
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+        if not victims:
+            return 0
+        self._evicted += len(victims)
+        logger.info(f"Image store evicted {len(victims)} files")
+        return len(victims)
+
+    def _evict_batch(self, now: float) -> list[str]:
+        # 其他进程可能也在写入，以索引中的合计为准
+        self._total_bytes, self._files = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0), COUNT(*) FROM images"
+        ).fetchone()
+        expired = self._db.execute(
+            "SELECT name, size, created FROM images WHERE accessed < ? ORDER BY accessed LIMIT ?",
+            (now - self.ttl, self.batch_size),
+        ).fetchall()
+        victims = [(name, created) for name, _, created in expired]
+        excess = self._total_bytes - sum(size for _, size, _ in expired) - self.max_bytes
+        if excess > 0 and len(victims) < self.batch_size:
+            for name, size, created in self._db.execute(
+                "SELECT name, size, created FROM images WHERE accessed >= ? "
+                "ORDER BY accessed LIMIT ?",
+                (now - self.ttl, self.batch_size - len(victims)),
+            ):
+                if excess <= 0:
+                    break
+                victims.append((name, created))
+                excess -= size
+        if not victims:
+            return []
+        names = [name for name, _ in victims]
+        self._delete(names)
+        for name, created in victims:
+            path = self.path_for(name)
+            try:
+                # 文件在建立索引后被重新写入（其他进程刚渲染完、尚未 add），保留它
+                if path.stat().st_mtime > created:
+                    continue
+                path.unlink()
+            except FileNotFoundError:
+                pass
+        return names
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "bytes": self._total_bytes,
+                "files": self._files,
+                "max_bytes": self.max_bytes,
+                "evictions": self._evicted,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_access()
+            self._db.close()
+
+    def _delete(self, names: list[str]) -> None:
+        placeholders = ",".join("?" * len(names))
+        removed_bytes, removed_files = self._db.execute(
+            f"SELECT COALESCE(SUM(size), 0), COUNT(*) FROM images WHERE name IN ({placeholders})",
+            names,
+        ).fetchone()
+        self._db.execute(f"DELETE FROM images WHERE name IN ({placeholders})", names)
+        self._total_bytes -= removed_bytes
+        self._files -= removed_files
+
+    def _flush_access(self) -> None:
+        if not self._pending_access:
+            return
+        self._db.executemany(
+            "UPDATE images SET accessed = MAX(accessed, ?) WHERE name = ?",
+            [(accessed, name) for name, accessed in self._pending_access.items()],
+        )
+        self._pending_access.clear()
+
+    def _import_flat_files(self) -> None:
+        """Move files left in the root by the old flat layout into shards."""
+        rows = []
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                target = self.path_for(entry.name)
+                target.parent.mkdir(exist_ok=True)
+                os.replace(entry.path, target)
+                rows.append((entry.name, stat.st_size, stat.st_mtime, stat.st_mtime))
+        if rows:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO images (name, size, created, accessed) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            logger.info(f"Imported {len(rows)} files from the flat images directory")
@@ -0,0 +1,242 @@
+import contextlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+from process_locks import file_lock
+
+logger = logging.getLogger(__name__)
+
+# 只接受普通的包名，避免被当作 tlmgr / apt-get 的选项
+PACKAGE_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._+-]*$")
+
+# 预检时尝试的文件后缀
+PREFLIGHT_SUFFIXES = (".sty", ".cls")
+
+
+class InstallJob:
+    """State of one background package installation."""
+
+    def __init__(self, package: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.package = package
+        # queued -> running -> installed / already_installed / failed
+        self.status = "queued"
+        self.message = ""
+        self.created_at = time.time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("installed", "already_installed", "failed")
+
+    def as_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "package": self.package,
+            "status": self.status,
+            "message": self.message,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "InstallJob":
+        job = cls(data["package"])
+        job.id = data["job_id"]
+        job.status = data["status"]
+        job.message = data["message"]
+        job.created_at = data["created_at"]
+        job.started_at = data["started_at"]
+        job.finished_at = data["finished_at"]
+        return job
+
+
+def is_installed(package: str) -> str | None:
+    """Path of ``<package>.sty`` / ``.cls`` if TeX can already find it."""
+    if shutil.which("kpsewhich") is None:
+        return None
+    names = [f"{package}{suffix}" for suffix in PREFLIGHT_SUFFIXES]
+    try:
+        result = subprocess.run(
+            ["kpsewhich", "-engine=xetex", *names], capture_output=True, text=True, timeout=30
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return next((path for path in result.stdout.splitlines() if path), None)
+
+
+def install_package(package: str) -> str:
+    """Install a TeX package using tlmgr or apt-get; raise RuntimeError on failure."""
+    try:
+        # 首先尝试使用 tlmgr
+        result = subprocess.run([
+            "tlmgr", "install", package
+        ], capture_output=True, text=True, timeout=300)
+        if result.returncode == 0:
+            return f"Successfully installed TeX package: {package}"
+
+        # 如果tlmgr不可用，尝试使用apt-get
+        result = subprocess.run([
+            "apt-get", "update"
+        ], capture_output=True, text=True, timeout=60)
+        if result.returncode != 0:
+            raise RuntimeError(f"Failed to install package {package}: {result.stderr}")
+
+        result = subprocess.run([
+            "apt-get", "install", "-y", f"texlive-{package}"
+        ], capture_output=True, text=True, timeout=300)
+        if result.returncode != 0:
+            raise RuntimeError(f"Failed to install package {package} via apt-get: {result.stderr}")
+        return f"Successfully installed TeX package: texlive-{package}"
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"Installation timeout for package: {package}")
+    except FileNotFoundError as e:
+        raise RuntimeError(f"Error installing package {package}: {e}")
+
+
+class PackageInstaller:
+    """Runs package installations as background jobs, one at a time.
+
+    tlmgr and apt-get hold a global lock, so jobs run on a single thread.
+    A request for a package that is already queued or installing returns the
+    existing job. Jobs whose package TeX can already find finish at once as
+    ``already_installed``. After a successful install ``on_installed`` runs
+    on the installer thread to refresh whatever depends on the TeX tree.
+
+    With ``state_dir`` (multi-process mode) jobs are also written there, so
+    any server process can report their status, and installs are serialised
+    across processes with a lock file.
+    """
+
+    def __init__(
+        self,
+        on_installed: Callable[[str], None] | None = None,
+        max_jobs: int = 100,
+        state_dir: Path | None = None,
+    ):
+        self.on_installed = on_installed
+        self.max_jobs = max_jobs
+        self.state_dir = state_dir
+        if state_dir is not None:
+            state_dir.mkdir(parents=True, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tex-install")
+        self._lock = threading.Lock()
+        self._jobs: OrderedDict[str, InstallJob] = OrderedDict()
+        # 每个包当前未完成的任务，用于合并重复请求
+        self._active: dict[str, InstallJob] = {}
+
+    def submit(self, package: str) -> tuple[InstallJob, bool]:
+        """Queue an install of ``package``; return (job, whether it is new)."""
+        if not PACKAGE_NAME.match(package):
+            raise ValueError(f"Invalid package name: {package}")
+        with self._lock:
+            job = self._active.get(package)
+            if job is not None:
+                return job, False
+            job = InstallJob(package)
+            self._active[package] = job
+            self._jobs[job.id] = job
+            self._trim()
+        self._save(job)
+        self._executor.submit(self._run, job)
+        return job, True
+
+    def get(self, job_id: str) -> InstallJob | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.state_dir is not None:
+            # 可能是其他服务进程提交的任务
+            try:
+                data = json.loads(self._state_file(job_id).read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                return None
+            job = InstallJob.from_dict(data)
+        return job
+
+    def recent(self, limit: int = 20) -> list[InstallJob]:
+        with self._lock:
+            return list(self._jobs.values())[-limit:]
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts: dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: InstallJob) -> None:
+        lock = contextlib.nullcontext()
+        if self.state_dir is not None:
+            # 其他服务进程的安装完成后再开始，届时预检通常会发现包已安装
+            lock = file_lock(self.state_dir / "install.lock")
+        try:
+            with lock:
+                job.status = "running"
+                job.started_at = time.time()
+                self._save(job)
+                found = is_installed(job.package)
+                if found:
+                    job.status = "already_installed"
+                    job.message = f"TeX package {job.package} is already installed: {found}"
+                    return
+                logger.info(f"Installing TeX package: {job.package}")
+                job.message = install_package(job.package)
+            if self.on_installed is not None:
+                try:
+                    self.on_installed(job.package)
+                except Exception as e:
+                    logger.exception(f"Refreshing after installing {job.package} failed")
+                    job.message += f" (refresh failed: {e})"
+            job.status = "installed"
+            logger.info(f"TeX package installation completed: {job.package}")
+        except Exception as e:
+            job.status = "failed"
+            job.message = str(e)
+            logger.warning(f"TeX package installation failed: {job.package}: {e}")
+        finally:
+            job.finished_at = time.time()
+            self._save(job)
+            with self._lock:
+                if self._active.get(job.package) is job:
+                    del self._active[job.package]
+
+    def _state_file(self, job_id: str) -> Path:
+        return self.state_dir / f"{job_id}.json"
+
+    def _save(self, job: InstallJob) -> None:
+        if self.state_dir is None:
+            return
+        # 先写临时文件再替换，读取方不会看到写了一半的内容
+        path = self._state_file(job.id)
+        temp = path.with_suffix(".tmp")
+        try:
+            temp.write_text(json.dumps(job.as_dict()), encoding="utf-8")
+            os.replace(temp, path)
+        except OSError as e:
+            logger.warning(f"Failed to save state of install job {job.id}: {e}")
+
+    def _trim(self) -> None:
+        # 只保留最近的 max_jobs 个任务，未完成的任务不删除
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            if self._jobs[job_id].done:
+                del self._jobs[job_id]
+                if self.state_dir is not None:
+                    self._state_file(job_id).unlink(missing_ok=True)
@@ -0,0 +1,92 @@
+import contextlib
+import fcntl
+import hashlib
+import os
+import time
+from collections.abc import Iterator
+from pathlib import Path
+
+from sandbox import Cancellation
+
+# 等待锁时的轮询间隔，期间检查渲染是否已被取消
+POLL_INTERVAL = 0.05
+
+
+def _try_lock(path: Path) -> int | None:
+    """Open ``path`` and take its flock without blocking; return the fd or None."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+@contextlib.contextmanager
+def file_lock(path: Path, cancellation: Cancellation | None = None) -> Iterator[None]:
+    """Hold an exclusive flock on ``path`` until the block exits.
+
+    flock locks belong to the open file, so the lock excludes other threads
+    of this process as well as other processes. While waiting, a cancelled
+    render gives up with RenderCancelled.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    while (fd := _try_lock(path)) is None:
+        if cancellation is not None:
+            cancellation.check()
+        time.sleep(POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        # 关闭文件即释放锁
+        os.close(fd)
+
+
+class RenderSlots:
+    """Node-wide limit on concurrent renders, shared by all server processes.
+
+    Each of the ``slots`` slots is a lock file under ``lock_dir``; a render
+    holds the flock of one free slot while it runs. Locks are released by
+    the kernel when a process dies, so a crashed worker never leaks a slot.
+    """
+
+    def __init__(self, lock_dir: Path, slots: int):
+        self.lock_dir = lock_dir
+        self.slots = slots
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+
+    @contextlib.contextmanager
+    def hold(self, cancellation: Cancellation | None = None) -> Iterator[None]:
+        """Wait for a free slot and hold it until the block exits."""
+        while True:
+            for slot in range(self.slots):
+                fd = _try_lock(self.lock_dir / f"slot-{slot}.lock")
+                if fd is not None:
+                    try:
+                        yield
+                    finally:
+                        os.close(fd)
+                    return
+            if cancellation is not None:
+                cancellation.check()
+            time.sleep(POLL_INTERVAL)
+
+
+class DocumentLocks:
+    """Cross-process locks that keep server processes from rendering one document twice.
+
+    Keys are hashed onto a fixed number of lock files, so the directory does
+    not grow with the cache; two documents sharing a stripe merely wait for
+    each other.
+    """
+
+    def __init__(self, lock_dir: Path, stripes: int = 256):
+        self.lock_dir = lock_dir
+        self.stripes = stripes
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+
+    def hold(self, key: str, cancellation: Cancellation | None = None):
+        digest = hashlib.sha256(key.encode("utf-8")).digest()
+        stripe = int.from_bytes(digest[:4], "big") % self.stripes
+        return file_lock(self.lock_dir / f"document-{stripe:03d}.lock", cancellation)
@@ -0,0 +1,90 @@
+import asyncio
+import contextvars
+import logging
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# 渲染流水线的进度阶段，依次对应 progress 1..4
+STAGES = ("queued", "compiling", "rasterizing", "stored")
+
+# 当前请求的进度上报器；RenderPool 会把上下文带到工作线程
+_reporter: contextvars.ContextVar["ProgressReporter | None"] = contextvars.ContextVar(
+    "progress_reporter", default=None
+)
+
+
+def report(stage: str, message: str | None = None) -> None:
+    """Report that the current request reached ``stage``; safe from any thread."""
+    reporter = _reporter.get()
+    if reporter is not None:
+        reporter.report(stage, message)
+
+
+class ProgressReporter:
+    """Sends MCP progress notifications for the pipeline stages of one tool call.
+
+    Only active when the client passed a ``progressToken``. Stages may be
+    reported from render threads; notifications are sent in order on the
+    event loop and tied to the originating request, so streamable HTTP
+    delivers them on that request's SSE stream.
+
+    With ``items`` set (batch renders) progress counts stored diagrams out
+    of ``items`` instead: bisection recompiles parts of a batch, so its
+    stages repeat and would make the progress value go backwards.
+    """
+
+    def __init__(self, request_context: Any):
+        meta = request_context.meta
+        self.token = meta.progressToken if meta is not None else None
+        self.session = request_context.session
+        self.request_id = request_context.request_id
+        self._loop = asyncio.get_running_loop()
+        self._last: asyncio.Task | None = None
+        self.items: int | None = None
+        self._stored = 0
+
+    def install(self) -> None:
+        """Route ``report()`` calls made in this context to this reporter."""
+        if self.token is not None:
+            _reporter.set(self)
+
+    def report(self, stage: str, message: str | None = None) -> None:
+        self._loop.call_soon_threadsafe(self._schedule, stage, message)
+
+    async def flush(self) -> None:
+        """Wait until every reported stage has been sent."""
+        if self._last is not None:
+            await asyncio.wait([self._last])
+
+    def _schedule(self, stage: str, message: str | None) -> None:
+        if self.items is None:
+            progress, total = STAGES.index(stage) + 1, len(STAGES)
+        elif stage == "queued":
+            progress, total = 0, self.items
+        elif stage == "stored":
+            self._stored += 1
+            progress, total = self._stored, self.items
+        else:
+            # 批量渲染只上报排队和每个图形的完成，进度值必须递增
+            return
+        text = f"{stage}: {message}" if message else stage
+        # 每条通知等待上一条发送完毕，保证顺序
+        self._last = self._loop.create_task(self._send(self._last, progress, total, text))
+
+    async def _send(
+        self, previous: asyncio.Task | None, progress: int, total: int, message: str
+    ) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await self.session.send_progress_notification(
+                self.token,
+                progress=progress,
+                total=total,
+                message=message,
+                related_request_id=self.request_id,
+            )
+        except Exception as e:
+            # 客户端可能已经断开
+            logger.debug(f"Failed to send progress notification: {e}")
@@ -0,0 +1,299 @@
+import importlib.util
+import logging
+import shutil
+import subprocess
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import sandbox
+from sandbox import SandboxLimits
+
+logger = logging.getLogger(__name__)
+
+MIME_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+}
+
+
+class Rasterizer(ABC):
+    """Converts pages of a PDF into bitmap images.
+
+    Backends implement ``available`` and ``rasterize``; ``rasterize_pages``
+    may be overridden when the tool can render all pages in one run.
+    """
+
+    name = ""
+    formats: tuple[str, ...] = ("png",)
+    # 外部转换进程的资源限制；进程内的后端（pdfium、PyMuPDF）不受约束
+    limits = SandboxLimits()
+
+    @abstractmethod
+    def available(self) -> bool:
+        """Whether the backend's tool or module is installed."""
+
+    @abstractmethod
+    def rasterize(
+        self,
+        pdf_path: Path,
+        output_path: Path,
+        dpi: int = 300,
+        image_format: str = "png",
+        antialias: bool = True,
+        page: int = 1,
+    ) -> None:
+        """Render the 1-based ``page`` of ``pdf_path`` to ``output_path``."""
+
+    def rasterize_pages(
+        self,
+        pdf_path: Path,
+        output_paths: list[Path],
+        dpi: int = 300,
+        image_format: str = "png",
+        antialias: bool = True,
+    ) -> None:
+        """Render page ``i + 1`` of ``pdf_path`` to ``output_paths[i]``."""
+        for page, output_path in enumerate(output_paths, start=1):
+            self.rasterize(pdf_path, output_path, dpi, image_format, antialias, page=page)
+
+    def _run(self, cmd: list[str]) -> None:
+        try:
+            sandbox.run(cmd, self.limits)
+        except subprocess.CalledProcessError as e:
+            stderr = e.stderr.decode("utf-8", errors="ignore").strip()
+            raise RuntimeError(f"Image conversion failed ({self.name}): {stderr or e}")
+
+
+class PdftocairoRasterizer(Rasterizer):
+    """poppler's pdftocairo, rendering straight from the PDF with cairo."""
+
+    name = "pdftocairo"
+    formats = ("png", "jpeg")
+
+    def available(self) -> bool:
+        return shutil.which("pdftocairo") is not None
+
+    def rasterize(self, pdf_path, output_path, dpi=300, image_format="png", antialias=True, page=1):
+        # pdftocairo 会自动补上扩展名，因此传入不带后缀的输出路径
+        cmd = self._command(dpi, image_format, antialias)
+        cmd += ["-f", str(page), "-l", str(page), "-singlefile"]
+        produced = output_path.with_suffix(self._extension(image_format))
+        self._run([*cmd, str(pdf_path), str(produced.with_suffix(""))])
+        if produced != output_path:
+            produced.replace(output_path)
+
+    def rasterize_pages(self, pdf_path, output_paths, dpi=300, image_format="png", antialias=True):
+        # 一次运行输出所有页面，文件名形如 prefix-1.png 或 prefix-01.png
+        prefix = output_paths[0].parent / "pdftocairo-page"
+        cmd = self._command(dpi, image_format, antialias)
+        self._run([*cmd, str(pdf_path), str(prefix)])
+        produced = sorted(
+            prefix.parent.glob(f"{prefix.name}-*{self._extension(image_format)}"),
+            key=lambda path: int(path.stem.rsplit("-", 1)[1]),
+        )
+        if len(produced) != len(output_paths):
+            raise RuntimeError(
+                f"Image conversion failed (pdftocairo): expected {len(output_paths)} pages, got {len(produced)}"
+            )
+        for path, output_path in zip(produced, output_paths):
+            path.replace(output_path)
+
+    @staticmethod
+    def _command(dpi: int, image_format: str, antialias: bool) -> list[str]:
+        cmd = ["pdftocairo", f"-{image_format}", "-r", str(dpi)]
+        if image_format == "png":
+            cmd.append("-transp")
+        if not antialias:
+            cmd += ["-antialias", "none"]
+        return cmd
+
+    @staticmethod
+    def _extension(image_format: str) -> str:
+        return ".jpg" if image_format == "jpeg" else ".png"
+
+
+class MutoolRasterizer(Rasterizer):
+    """MuPDF's ``mutool draw``."""
+
+    name = "mutool"
+    formats = ("png",)
+
+    def available(self) -> bool:
+        return shutil.which("mutool") is not None
+
+    def rasterize(self, pdf_path, output_path, dpi=300, image_format="png", antialias=True, page=1):
+        self._run([*self._command(dpi, antialias), "-o", str(output_path), str(pdf_path), str(page)])
+
+    def rasterize_pages(self, pdf_path, output_paths, dpi=300, image_format="png", antialias=True):
+        # 不指定页码时 mutool 输出全部页面，%d 为从 1 开始的页码
+        pattern = output_paths[0].parent / "mutool-page-%d.png"
+        self._run([*self._command(dpi, antialias), "-o", str(pattern), str(pdf_path)])
+        for page, output_path in enumerate(output_paths, start=1):
+            produced = Path(str(pattern).replace("%d", str(page)))
+            if not produced.exists():
+                raise RuntimeError(f"Image conversion failed (mutool): page {page} missing")
+            produced.replace(output_path)
+
+    @staticmethod
+    def _command(dpi: int, antialias: bool) -> list[str]:
+        return [
+            "mutool", "draw",
+            "-q",
+            "-r", str(dpi),
+            "-A", "8" if antialias else "0",
+            "-c", "rgba",
+            "-F", "png",
+        ]
+
+
+class PdfiumRasterizer(Rasterizer):
+    """In-process rendering with pypdfium2 (PDFium), saved through Pillow."""
+
+    name = "pypdfium2"
+    formats = ("png", "jpeg", "webp")
+    # PDFium 不是线程安全的
+    _lock = threading.Lock()
+
+    def available(self) -> bool:
+        return (
+            importlib.util.find_spec("pypdfium2") is not None
+            and importlib.util.find_spec("PIL") is not None
+        )
+
+    def rasterize(self, pdf_path, output_path, dpi=300, image_format="png", antialias=True, page=1):
+        self._render(pdf_path, {page: output_path}, dpi, image_format, antialias)
+
+    def rasterize_pages(self, pdf_path, output_paths, dpi=300, image_format="png", antialias=True):
+        pages = {page: path for page, path in enumerate(output_paths, start=1)}
+        self._render(pdf_path, pages, dpi, image_format, antialias)
+
+    def _render(self, pdf_path, pages, dpi, image_format, antialias):
+        import pypdfium2 as pdfium
+
+        transparent = image_format != "jpeg"
+        images = {}
+        with self._lock:
+            pdf = pdfium.PdfDocument(str(pdf_path))
+            try:
+                for page in pages:
+                    bitmap = pdf[page - 1].render(
+                        scale=dpi / 72,
+                        fill_color=(255, 255, 255, 0 if transparent else 255),
+                        no_smoothtext=not antialias,
+                        no_smoothimage=not antialias,
+                        no_smoothpath=not antialias,
+                    )
+                    images[page] = bitmap.to_pil()
+            finally:
+                pdf.close()
+        # 编码在锁外进行，Pillow 编码时会释放 GIL
+        for page, image in images.items():
+            if image_format == "jpeg":
+                image = image.convert("RGB")
+            image.save(pages[page], format=image_format.upper())
+
+
+class PyMuPDFRasterizer(Rasterizer):
+    """In-process rendering with PyMuPDF (MuPDF)."""
+
+    name = "pymupdf"
+    formats = ("png", "jpeg")
+    _lock = threading.Lock()
+
+    def available(self) -> bool:
+        return (
+            importlib.util.find_spec("pymupdf") is not None
+            or importlib.util.find_spec("fitz") is not None
+        )
+
+    def rasterize(self, pdf_path, output_path, dpi=300, image_format="png", antialias=True, page=1):
+        self._render(pdf_path, {page: output_path}, dpi, image_format, antialias)
+
+    def rasterize_pages(self, pdf_path, output_paths, dpi=300, image_format="png", antialias=True):
+        pages = {page: path for page, path in enumerate(output_paths, start=1)}
+        self._render(pdf_path, pages, dpi, image_format, antialias)
+
+    def _render(self, pdf_path, pages, dpi, image_format, antialias):
+        try:
+            import pymupdf
+        except ImportError:
+            # 1.24.3 之前的版本只提供 fitz 模块名
+            import fitz as pymupdf
+
+        with self._lock:
+            # 抗锯齿级别是全局设置，必须在锁内修改
+            pymupdf.TOOLS.set_aa_level(8 if antialias else 0)
+            with pymupdf.open(str(pdf_path)) as doc:
+                for page, output_path in pages.items():
+                    pixmap = doc[page - 1].get_pixmap(dpi=dpi, alpha=image_format != "jpeg")
+                    pixmap.save(str(output_path), output="jpg" if image_format == "jpeg" else "png")
+
+
+class ImageMagickRasterizer(Rasterizer):
+    """ImageMagick ``convert`` (through Ghostscript); the historical default."""
+
+    name = "imagemagick"
+    formats = ("png", "jpeg", "webp")
+
+    def available(self) -> bool:
+        return shutil.which("convert") is not None
+
+    def rasterize(self, pdf_path, output_path, dpi=300, image_format="png", antialias=True, page=1):
+        cmd = self._command(dpi, antialias)
+        self._run([*cmd, f"{pdf_path}[{page - 1}]", f"{image_format}:{output_path}"])
+
+    def rasterize_pages(self, pdf_path, output_paths, dpi=300, image_format="png", antialias=True):
+        # 多页输出时 %d 为从 0 开始的页序号
+        pattern = output_paths[0].parent / f"convert-page-%d.{image_format}"
+        cmd = self._command(dpi, antialias)
+        self._run([*cmd, str(pdf_path), "+adjoin", f"{image_format}:{pattern}"])
+        for index, output_path in enumerate(output_paths):
+            produced = Path(str(pattern).replace("%d", str(index)))
+            if not produced.exists():
+                raise RuntimeError(f"Image conversion failed (imagemagick): page {index + 1} missing")
+            produced.replace(output_path)
+
+    @staticmethod
+    def _command(dpi: int, antialias: bool) -> list[str]:
+        cmd = ["convert", "-density", str(dpi), "-quality", "90"]
+        if not antialias:
+            cmd.append("+antialias")
+        return cmd
+
+
+# 自动选择时的优先顺序：外部进程可以并行执行，优先于需要加锁的进程内实现
+RASTERIZERS: dict[str, Rasterizer] = {
+    rasterizer.name: rasterizer
+    for rasterizer in (
+        PdftocairoRasterizer(),
+        MutoolRasterizer(),
+        PdfiumRasterizer(),
+        PyMuPDFRasterizer(),
+        ImageMagickRasterizer(),
+    )
+}
+
+
+def available_rasterizers() -> list[str]:
+    return [name for name, rasterizer in RASTERIZERS.items() if rasterizer.available()]
+
+
+def select_rasterizer(name: str = "auto", image_format: str = "png") -> Rasterizer | None:
+    """Return the requested backend, or the first installed one for ``auto``."""
+    if name != "auto":
+        rasterizer = RASTERIZERS.get(name)
+        if rasterizer is None:
+            raise ValueError(f"Unknown rasterizer: {name}. Available: {', '.join(RASTERIZERS)}")
+        if not rasterizer.available():
+            raise RuntimeError(f"Rasterizer {name} is not installed")
+        if image_format not in rasterizer.formats:
+            raise RuntimeError(f"Rasterizer {name} cannot produce {image_format} images")
+        return rasterizer
+
+    for rasterizer in RASTERIZERS.values():
+        if image_format in rasterizer.formats and rasterizer.available():
+            return rasterizer
+    logger.error(f"No PDF rasterizer able to produce {image_format} images is installed")
+    return None
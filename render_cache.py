@@ -0,0 +1,207 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import NamedTuple
+
+from image_store import ImageStore
+
+logger = logging.getLogger(__name__)
+
+
+# 改变 catcode、逐字读取内容的环境和命令，其中的空白有意义
+VERBATIM_BEGIN = re.compile(
+    r"\\begin\{(verbatim\*?|Verbatim\*?|BVerbatim|LVerbatim|lstlisting|minted|alltt"
+    r"|comment|filecontents\*?)\}"
+)
+VERBATIM_INLINE = re.compile(r"\\(verb|lstinline|mintinline)\b")
+SPACES = re.compile(r" {2,}")
+
+
+def normalize_tikz(tikz_code: str) -> str:
+    """Normalize whitespace that cannot change the rendered output.
+
+    Used only for the cache key; the submitted code is what gets compiled.
+    Runs of spaces collapse to one, leading and trailing spaces on a line
+    are dropped and consecutive blank lines count as one, so inputs that
+    only differ in those respects share a cache entry. Tabs are kept (e.g.
+    ``col sep=tab`` tables), as are lines inside verbatim-like environments
+    and lines using ``\\verb``-like commands.
+    """
+    lines: list[str] = []
+    verbatim_end = None
+    for raw_line in tikz_code.splitlines():
+        if verbatim_end is not None:
+            lines.append(raw_line)
+            if verbatim_end in raw_line:
+                verbatim_end = None
+            continue
+        begin = VERBATIM_BEGIN.search(raw_line)
+        if begin is not None:
+            end = f"\\end{{{begin.group(1)}}}"
+            if end not in raw_line[begin.end():]:
+                verbatim_end = end
+            lines.append(raw_line)
+            continue
+        if VERBATIM_INLINE.search(raw_line):
+            lines.append(raw_line)
+            continue
+        line = SPACES.sub(" ", raw_line.strip(" "))
+        if not line and (not lines or not lines[-1]):
+            continue
+        lines.append(line)
+    while lines and not lines[-1]:
+        lines.pop()
+    return "\n".join(lines)
+
+
+def cache_key(latex_document: str, options: dict) -> str:
+    """Hash of the fully expanded LaTeX document plus render options."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(latex_document.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class CacheEntry(NamedTuple):
+    filename: str
+    data: bytes | None
+    size: int
+
+
+class RenderCache:
+    """Two-tier (memory LRU + on-disk) cache of rendered images.
+
+    Keys are file names (``<hash>.<ext>``); the disk tier is the
+    :class:`ImageStore` behind the ``/images`` route, so a hit can be served
+    from there directly. The memory tier keeps the bytes of recently used
+    entries for base64 responses.
+    """
+
+    def __init__(
+        self,
+        store: ImageStore,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 86400.0,
+    ):
+        self.store = store
+        self.max_memory_bytes = max_memory_bytes
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._memory: OrderedDict[str, tuple[CacheEntry, float]] = OrderedDict()
+        self._memory_bytes = 0
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+        }
+
+    def path_for(self, key: str) -> Path:
+        return self.store.path_for(key)
+
+    def get(
+        self,
+        key: str,
+        with_data: bool,
+        count_miss: bool = True,
+        max_data_bytes: int | None = None,
+    ) -> CacheEntry | None:
+        """Return the cached entry for ``key`` or None on a miss.
+
+        With ``max_data_bytes`` the bytes of larger files are not loaded.
+        """
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                entry, stored_at = item
+                has_data = (
+                    entry.data is not None
+                    or not with_data
+                    or (max_data_bytes is not None and entry.size > max_data_bytes)
+                )
+                if now - stored_at <= self.ttl and has_data:
+                    self._memory.move_to_end(key)
+                else:
+                    self._drop_memory(key)
+                    item = None
+
+        # 索引同时负责校验文件是否已被淘汰，并记录访问时间
+        size = self.store.lookup(key)
+        if size is None:
+            with self._lock:
+                self._drop_memory(key)
+                if count_miss:
+                    self._counters["misses"] += 1
+            return None
+
+        if item is not None:
+            with self._lock:
+                self._counters["memory_hits"] += 1
+            return item[0]
+
+        if max_data_bytes is not None and size > max_data_bytes:
+            with_data = False
+        try:
+            data = self.path_for(key).read_bytes() if with_data else None
+        except FileNotFoundError:
+            self.store.forget(key)
+            if count_miss:
+                with self._lock:
+                    self._counters["misses"] += 1
+            return None
+
+        entry = CacheEntry(key, data, size)
+        with self._lock:
+            self._counters["disk_hits"] += 1
+            self._remember(key, entry, now)
+        return entry
+
+    def put(self, key: str, data: bytes | None) -> CacheEntry:
+        """Record a freshly rendered file that already exists at ``path_for(key)``."""
+        size = len(data) if data is not None else self.path_for(key).stat().st_size
+        self.store.add(key, size)
+        entry = CacheEntry(key, data, size)
+        with self._lock:
+            self._remember(key, entry, time.time())
+        return entry
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_bytes
+        store_stats = self.store.stats()
+        stats["disk_bytes"] = store_stats["bytes"]
+        stats["disk_files"] = store_stats["files"]
+        stats["disk_evictions"] = store_stats["evictions"]
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = (
+            (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        )
+        return stats
+
+    def _remember(self, key: str, entry: CacheEntry, stored_at: float) -> None:
+        size = len(entry.data) if entry.data is not None else 0
+        if size > self.max_memory_bytes:
+            entry = entry._replace(data=None)
+            size = 0
+        self._drop_memory(key)
+        self._memory[key] = (entry, stored_at)
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes and self._memory:
+            oldest = next(iter(self._memory))
+            self._drop_memory(oldest)
+            self._counters["memory_evictions"] += 1
+
+    def _drop_memory(self, key: str) -> None:
+        item = self._memory.pop(key, None)
+        if item is not None and item[0].data is not None:
+            self._memory_bytes -= len(item[0].data)
@@ -0,0 +1,126 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from metrics import record_stage
+from process_locks import RenderSlots
+from sandbox import Cancellation, current_cancellation
+
+logger = logging.getLogger(__name__)
+
+
+class RenderQueueFull(RuntimeError):
+    """Raised when the admission queue has no room for another render."""
+
+
+class RenderTimeout(RuntimeError):
+    """Raised when a render does not finish within the per-request timeout."""
+
+
+class RenderPool:
+    """Bounded worker pool that keeps blocking TeX renders off the event loop.
+
+    Up to ``workers`` renders run concurrently in worker threads (the heavy
+    lifting happens in xelatex/convert child processes, so threads are enough
+    to use all cores). At most ``max_queue`` further renders may wait for a
+    free worker; anything beyond that is rejected immediately. With
+    ``slots`` (multi-process mode) a job additionally waits for one of the
+    node-wide render slots shared by all server processes.
+    """
+
+    def __init__(
+        self, workers: int, max_queue: int, timeout: float, slots: RenderSlots | None = None
+    ):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.slots = slots
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="tikz-render"
+        )
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queued = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "active": self._active,
+                "queued": self._queued,
+                "max_queue": self.max_queue,
+            }
+
+    async def run(
+        self, func: Callable[..., Any], *args: Any, timeout: float | None = None
+    ) -> Any:
+        """Run ``func(*args)`` in the pool and await its result.
+
+        ``timeout`` overrides the pool's per-request timeout, e.g. for batches.
+        When the caller is cancelled or times out, the TeX and conversion
+        processes of the job are killed so its worker is freed early.
+        """
+        timeout = timeout or self.timeout
+        with self._lock:
+            if self._active + self._queued >= self.workers + self.max_queue:
+                raise RenderQueueFull(
+                    f"Render queue is full ({self.max_queue} waiting), please retry later"
+                )
+            self._queued += 1
+
+        submitted = time.perf_counter()
+        cancellation = Cancellation()
+
+        def job() -> Any:
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+            try:
+                # 排队期间已被取消的任务直接结束
+                cancellation.check()
+                with self.slots.hold(cancellation) if self.slots else contextlib.nullcontext():
+                    # 等待其他进程释放渲染槽位的时间也计入排队
+                    record_stage("queue_wait", time.perf_counter() - submitted)
+                    current_cancellation.set(cancellation)
+                    return func(*args)
+            finally:
+                with self._lock:
+                    self._active -= 1
+
+        loop = asyncio.get_running_loop()
+        try:
+            # 复制上下文，让工作线程记录的阶段耗时归入当前请求
+            context = contextvars.copy_context()
+            future = loop.run_in_executor(self._executor, context.run, job)
+        except BaseException:
+            with self._lock:
+                self._queued -= 1
+            raise
+
+        try:
+            # shield: 线程无法被中断，放弃等待后由 cancellation 杀掉其子进程
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Render exceeded {timeout}s timeout")
+            cancellation.cancel()
+            self._discard(future)
+            raise RenderTimeout(f"Rendering timed out after {timeout:g}s")
+        except asyncio.CancelledError:
+            # 客户端取消请求或断开连接
+            cancellation.cancel()
+            self._discard(future)
+            raise
+
+    @staticmethod
+    def _discard(future: asyncio.Future) -> None:
+        # 放弃等待的任务被杀掉后会以异常结束，读取该异常，
+        # 避免 asyncio 记录 "Future exception was never retrieved"
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
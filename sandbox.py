@@ -0,0 +1,243 @@
+import contextvars
+import logging
+import os
+import re
+import resource
+import signal
+import subprocess
+import threading
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# 禁止 \write18，限制 TeX 只能读写工作目录内的文件（openin/openout_any=p）
+HARDENED_TEX_ARGS = ["-no-shell-escape"]
+HARDENED_TEX_ENV = {"openin_any": "p", "openout_any": "p", "shell_escape": "f"}
+
+# 内存不足时 kpathsea/XeTeX/ImageMagick 输出的提示
+MEMORY_ERROR = re.compile(
+    r"memory exhausted|xmalloc|out of memory|bad_alloc|cannot allocate memory",
+    re.IGNORECASE,
+)
+# 忽略 SIGXFSZ 的程序写入超限时得到 EFBIG
+FILE_SIZE_ERROR = re.compile(r"file too large", re.IGNORECASE)
+# 进程数达到上限时 fork 失败的提示
+FORK_ERROR = re.compile(r"resource temporarily unavailable|cannot fork|fork failed", re.IGNORECASE)
+
+
+class SandboxLimits(NamedTuple):
+    """Resource limits for one external TeX or conversion process."""
+
+    cpu_seconds: int = 60
+    memory_bytes: int = 2 * 1024 * 1024 * 1024
+    file_size_bytes: int = 256 * 1024 * 1024
+    # RLIMIT_NPROC 统计的是同一用户的全部进程/线程，需要给服务自身留出余量
+    max_processes: int = 512
+    wall_seconds: float = 120.0
+
+    def rlimits(self) -> list[tuple[int, tuple[int, int]]]:
+        return [
+            (resource.RLIMIT_CPU, (self.cpu_seconds, self.cpu_seconds + 5)),
+            (resource.RLIMIT_AS, (self.memory_bytes, self.memory_bytes)),
+            (resource.RLIMIT_FSIZE, (self.file_size_bytes, self.file_size_bytes)),
+            (resource.RLIMIT_NPROC, (self.max_processes, self.max_processes)),
+        ]
+
+
+class SandboxError(RuntimeError):
+    """A sandboxed process was stopped for exceeding one of its limits."""
+
+    code = "sandbox"
+
+    def as_dict(self) -> dict:
+        return {"limit": self.code, "message": str(self)}
+
+
+class WallTimeExceeded(SandboxError):
+    code = "wall_time"
+
+
+class CpuLimitExceeded(SandboxError):
+    code = "cpu_time"
+
+
+class MemoryLimitExceeded(SandboxError):
+    code = "memory"
+
+
+class FileSizeLimitExceeded(SandboxError):
+    code = "file_size"
+
+
+class ProcessLimitExceeded(SandboxError):
+    code = "process_count"
+
+
+class RenderCancelled(RuntimeError):
+    """The render was cancelled and its processes were killed."""
+
+
+class Cancellation:
+    """Cancellation flag shared by a render job and the processes it waits on.
+
+    ``cancel()`` may be called from any thread; it kills the process groups
+    currently being waited on and makes later waits fail immediately.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._processes: set[subprocess.Popen] = set()
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            processes = list(self._processes)
+        for process in processes:
+            kill_group(process)
+
+    def check(self) -> None:
+        if self.cancelled:
+            raise RenderCancelled("Render cancelled")
+
+    def _add(self, process: subprocess.Popen) -> bool:
+        with self._lock:
+            if not self.cancelled:
+                self._processes.add(process)
+            return not self.cancelled
+
+    def _remove(self, process: subprocess.Popen) -> None:
+        with self._lock:
+            self._processes.discard(process)
+
+
+# 当前渲染任务的取消标志，由 RenderPool 在工作线程中设置
+current_cancellation: contextvars.ContextVar[Cancellation | None] = contextvars.ContextVar(
+    "current_cancellation", default=None
+)
+
+
+def hardened_env(env: dict[str, str] | None = None) -> dict[str, str]:
+    """Environment for a TeX run with restricted file access."""
+    return {**(env if env is not None else os.environ), **HARDENED_TEX_ENV}
+
+
+def spawn(cmd: list[str], limits: SandboxLimits, **popen_kwargs) -> subprocess.Popen:
+    """Start ``cmd`` in its own process group with ``limits`` applied."""
+    use_prlimit = hasattr(resource, "prlimit")
+
+    def apply_limits() -> None:
+        for limit, values in limits.rlimits():
+            resource.setrlimit(limit, values)
+
+    process = subprocess.Popen(
+        cmd,
+        start_new_session=True,
+        # Linux 上在启动后用 prlimit 设置，避免多线程下使用 preexec_fn
+        preexec_fn=None if use_prlimit else apply_limits,
+        **popen_kwargs,
+    )
+    if use_prlimit:
+        try:
+            for limit, values in limits.rlimits():
+                resource.prlimit(process.pid, limit, values)
+        except ProcessLookupError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to apply resource limits to {cmd[0]}: {e}")
+    return process
+
+
+def kill_group(process: subprocess.Popen) -> None:
+    """Kill the process and everything it started."""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        process.kill()
+
+
+def communicate(
+    process: subprocess.Popen,
+    limits: SandboxLimits,
+    input: bytes | None = None,
+    timeout: float | None = None,
+) -> tuple[bytes, bytes]:
+    """Wait for ``process``; kill its group and raise on a limit breach.
+
+    If the current render is cancelled meanwhile, the process group is
+    killed and ``RenderCancelled`` is raised.
+    """
+    timeout = timeout or limits.wall_seconds
+    name = os.path.basename(str(process.args[0]))
+    cancellation = current_cancellation.get()
+    if cancellation is not None and not cancellation._add(process):
+        kill_group(process)
+    try:
+        stdout, stderr = process.communicate(input=input, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_group(process)
+        process.communicate()
+        raise WallTimeExceeded(f"{name} timed out after {timeout:g}s")
+    finally:
+        if cancellation is not None:
+            cancellation._remove(process)
+    if cancellation is not None:
+        cancellation.check()
+    check_limits(name, process.returncode, _as_text(stdout) + _as_text(stderr), limits)
+    return stdout, stderr
+
+
+def check_limits(name: str, returncode: int, output: str, limits: SandboxLimits) -> None:
+    """Raise the matching SandboxError if the exit looks like a limit breach."""
+    # 软限制的 SIGXCPU 默认会终止进程，硬限制的 SIGKILL 只是兜底
+    if returncode == -signal.SIGXCPU:
+        raise CpuLimitExceeded(f"{name} used more than {limits.cpu_seconds}s of CPU time")
+    if returncode == -signal.SIGXFSZ or (returncode != 0 and FILE_SIZE_ERROR.search(output)):
+        raise FileSizeLimitExceeded(
+            f"{name} tried to write a file larger than {limits.file_size_bytes // (1024 * 1024)} MB"
+        )
+    if returncode == 0:
+        return
+    if MEMORY_ERROR.search(output):
+        raise MemoryLimitExceeded(
+            f"{name} ran out of memory (limit {limits.memory_bytes // (1024 * 1024)} MB)"
+        )
+    if FORK_ERROR.search(output):
+        raise ProcessLimitExceeded(
+            f"{name} could not start a subprocess (limit {limits.max_processes} processes)"
+        )
+
+
+def run(
+    cmd: list[str],
+    limits: SandboxLimits,
+    input: bytes | None = None,
+    timeout: float | None = None,
+    check: bool = True,
+    **popen_kwargs,
+) -> subprocess.CompletedProcess:
+    """``subprocess.run`` replacement that enforces ``limits``.
+
+    Output is always captured (pass ``text=True`` for strings). Non-zero
+    exits that are not limit breaches raise ``CalledProcessError`` when
+    ``check`` is set.
+    """
+    process = spawn(
+        cmd,
+        limits,
+        stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        **popen_kwargs,
+    )
+    stdout, stderr = communicate(process, limits, input=input, timeout=timeout)
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+
+def _as_text(output: bytes | str | None) -> str:
+    if isinstance(output, bytes):
+        return output.decode("utf-8", errors="ignore")
+    return output or ""
+
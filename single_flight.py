@@ -0,0 +1,50 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+
+class SingleFlight:
+    """Coalesces concurrent async calls that share a key.
+
+    The first caller for a key starts the work as its own task; callers
+    arriving while it runs await the same task and get the same result or
+    exception. The task is shielded, so one caller giving up (timeout,
+    disconnect) does not cancel the work for the others; it is cancelled
+    only when every caller waiting for it has been cancelled.
+    """
+
+    def __init__(self):
+        self._calls: dict[str, asyncio.Task] = {}
+        # 每个任务仍在等待的调用方数量
+        self._waiters: dict[asyncio.Task, int] = {}
+        self._counters = {"leaders": 0, "coalesced": 0}
+
+    async def do(self, key: str, func: Callable[..., Awaitable[Any]], *args: Any) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self._counters["leaders"] += 1
+        else:
+            self._counters["coalesced"] += 1
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters.get(task) == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    def stats(self) -> dict:
+        return {**self._counters, "in_flight": len(self._calls)}
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # 所有调用方都已放弃等待时，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
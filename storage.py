@@ -0,0 +1,194 @@
+import logging
+import mimetypes
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# 文件名为内容哈希，内容永不变化
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def public_base_url() -> str:
+    """Base URL of this service as seen by clients.
+
+    ``DOMAIN`` wins when set (``https://`` is assumed if it has no scheme),
+    otherwise ``http://PUBLIC_IP:PUBLIC_PORT``.
+    """
+    domain = os.getenv("DOMAIN", "").strip().rstrip("/")
+    if domain:
+        return domain if "://" in domain else f"https://{domain}"
+    public_ip = os.getenv("PUBLIC_IP", "localhost")
+    public_port = os.getenv("PUBLIC_PORT", "3000")
+    return f"http://{public_ip}:{public_port}"
+
+
+class Storage:
+    """Where rendered files live and how clients reach them.
+
+    Renders are always written to the local image store first; a backend
+    may additionally publish them (``save``), provide renders made by other
+    replicas (``fetch``) and tell the ``/images`` route where to send
+    clients for files this replica does not have (``redirect_url``).
+    """
+
+    name = ""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+
+    def public_url(self, key: str) -> str:
+        return f"{self.base_url}/images/{key}"
+
+    def save(self, key: str, path: Path) -> None:
+        """Publish the local file ``path`` under ``key``.
+
+        Must not return before ``public_url(key)`` works; raise RuntimeError
+        if the file cannot be published.
+        """
+
+    def fetch(self, key: str, dest: Path) -> bool:
+        """Download ``key`` to ``dest`` if another replica already rendered it."""
+        return False
+
+    def redirect_url(self, key: str) -> str | None:
+        """URL serving ``key`` when it is not in the local image store."""
+        return None
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+    def close(self) -> None:
+        pass
+
+
+class LocalStorage(Storage):
+    """Files stay in the local image store and are served by ``/images``."""
+
+    name = "local"
+
+
+class S3Storage(Storage):
+    """S3-compatible object store (AWS S3, MinIO, ...) shared by all replicas.
+
+    Without ``public_url`` clients keep using this service's ``/images``
+    URLs, which redirect to a presigned object URL on replicas that do not
+    have the file locally; uploads then run in a small background pool so
+    they never delay a response, the rendering replica serving the file
+    from its local store meanwhile. With ``public_url`` (public bucket or
+    CDN) the returned URLs point at the object store directly, so the
+    upload finishes before the URL is handed out.
+    """
+
+    name = "s3"
+
+    def __init__(
+        self,
+        base_url: str,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: str | None = None,
+        region: str | None = None,
+        public_url: str | None = None,
+        upload_workers: int = 4,
+        presign_ttl: int = 3600,
+    ):
+        super().__init__(base_url)
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("S3 storage requires boto3. Please install it: pip install boto3")
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.public_base = public_url.rstrip("/") if public_url else None
+        self.presign_ttl = presign_ttl
+        self._client_error = ClientError
+        # boto3 的 client 是线程安全的，可以在渲染线程和上传线程间共用
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        self._uploads = ThreadPoolExecutor(
+            max_workers=upload_workers, thread_name_prefix="s3-upload"
+        )
+        self._lock = threading.Lock()
+        self._counters = {"pending": 0, "uploaded": 0, "failed": 0, "fetched": 0}
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def public_url(self, key: str) -> str:
+        if self.public_base:
+            return f"{self.public_base}/{self.object_key(key)}"
+        return super().public_url(key)
+
+    def save(self, key: str, path: Path) -> None:
+        with self._lock:
+            self._counters["pending"] += 1
+        if self.public_base:
+            # URL 直接指向对象存储，上传完成前交给客户端会得到 404（CDN 还可能缓存它）
+            if not self._upload(key, path):
+                raise RuntimeError(f"Failed to upload {key} to s3://{self.bucket}")
+            return
+        self._uploads.submit(self._upload, key, path)
+
+    def fetch(self, key: str, dest: Path) -> bool:
+        try:
+            self.client.download_file(self.bucket, self.object_key(key), str(dest))
+        except self._client_error as e:
+            if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey"):
+                logger.warning(f"Failed to fetch {key} from s3://{self.bucket}: {e}")
+            return False
+        with self._lock:
+            self._counters["fetched"] += 1
+        return True
+
+    def redirect_url(self, key: str) -> str | None:
+        if self.public_base:
+            return self.public_url(key)
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self.object_key(key)},
+            ExpiresIn=self.presign_ttl,
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": self.name, "bucket": self.bucket, **self._counters}
+
+    def close(self) -> None:
+        # 等待已排队的上传完成，避免其他副本拿不到结果
+        self._uploads.shutdown(wait=True)
+
+    def _upload(self, key: str, path: Path) -> bool:
+        content_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+        try:
+            self.client.upload_file(
+                str(path),
+                self.bucket,
+                self.object_key(key),
+                ExtraArgs={"ContentType": content_type, "CacheControl": IMMUTABLE_CACHE_CONTROL},
+            )
+        except Exception as e:
+            # 本地文件可能已被淘汰，或对象存储暂时不可用；其他副本会重新渲染
+            logger.warning(f"Failed to upload {key} to s3://{self.bucket}: {e}")
+            outcome = "failed"
+        else:
+            outcome = "uploaded"
+        with self._lock:
+            self._counters["pending"] -= 1
+            self._counters[outcome] += 1
+        return outcome == "uploaded"
+
+
+def create_storage(backend: str, base_url: str | None = None, **options) -> Storage:
+    """Build the storage backend named ``backend`` (``local`` or ``s3``)."""
+    base_url = base_url or public_base_url()
+    if backend == "local":
+        return LocalStorage(base_url)
+    if backend == "s3":
+        if not options.get("bucket"):
+            raise ValueError("S3 storage requires a bucket (--s3-bucket / S3_BUCKET)")
+        return S3Storage(base_url, **options)
+    raise ValueError(f"Unknown storage backend: {backend}. Available: local, s3")
@@ -0,0 +1,183 @@
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from process_locks import file_lock
+
+logger = logging.getLogger(__name__)
+
+# 预编译格式中用于校验 TeX 安装是否变化的文件
+FINGERPRINT_FILES = [
+    "xelatex.fmt",
+    "standalone.cls",
+    "tikz.sty",
+    "pgfplots.sty",
+    "amsmath.sty",
+    "xcolor.sty",
+]
+
+# 其他服务进程可能仍在使用旧的格式文件，超过该时间才清理
+STALE_FORMAT_SECONDS = 86400
+
+
+class PreambleFormat:
+    """Precompiled xelatex format (.fmt) for the default standalone preamble.
+
+    The format is dumped with mylatexformat, which stops at
+    ``\\csname endofdump\\endcsname`` in the preamble: everything before it
+    (class, tikz, pgfplots, libraries) is loaded once at build time, while
+    font packages after it are still loaded per run, since XeTeX cannot dump
+    native fonts. Documents rendered with the format must contain the same
+    preamble text, so the output is identical with or without it.
+    """
+
+    def __init__(self, preamble: str, format_dir: Path, name: str = "tikz_preamble"):
+        self.preamble = preamble
+        self.format_dir = format_dir
+        self.name = name
+        self._lock = threading.Lock()
+        self._jobname: str | None = None
+        self._checked = False
+
+    @property
+    def available(self) -> bool:
+        return self._jobname is not None
+
+    def xelatex_args(self) -> list[str]:
+        """Extra xelatex arguments for a run that uses the format."""
+        if self._jobname is None:
+            return []
+        return [f"-fmt={self._jobname}"]
+
+    def env(self) -> dict[str, str] | None:
+        """Environment for a run that uses the format (None if unavailable)."""
+        if self._jobname is None:
+            return None
+        env = dict(os.environ)
+        # 末尾的分隔符表示继续搜索默认路径
+        env["TEXFORMATS"] = f"{self.format_dir.resolve()}{os.pathsep}"
+        return env
+
+    def invalidate(self) -> None:
+        """Forget the current format so the next ``ensure()`` re-fingerprints it."""
+        with self._lock:
+            self._jobname = None
+            self._checked = False
+
+    def ensure(self, rebuild: bool = False) -> bool:
+        """Build the format if it is missing or out of date; return availability.
+
+        ``rebuild`` builds it even if a format with the same fingerprint
+        exists, e.g. after packages were installed.
+        """
+        with self._lock:
+            if self._checked:
+                return self._jobname is not None
+            self._checked = True
+
+            if not shutil.which("xelatex") or not shutil.which("kpsewhich"):
+                logger.warning("xelatex/kpsewhich not found, preamble format disabled")
+                return False
+            if not self._kpsewhich(["mylatexformat.ltx"]):
+                logger.warning("mylatexformat.ltx not installed, preamble format disabled")
+                return False
+
+            jobname = f"{self.name}-{self._fingerprint()[:12]}"
+            fmt_file = self.format_dir / f"{jobname}.fmt"
+            # 多个服务进程同时启动时只由一个进程构建，其余进程等待后直接使用
+            with file_lock(self.format_dir / ".build.lock"):
+                if rebuild or not fmt_file.exists():
+                    try:
+                        self._build(jobname)
+                    except RuntimeError as e:
+                        logger.warning(f"Preamble format build failed, using full preamble: {e}")
+                        return False
+
+            self._jobname = jobname
+            if not self._smoke_test():
+                logger.warning("Preamble format failed its smoke test, using full preamble")
+                self._jobname = None
+                fmt_file.unlink(missing_ok=True)
+                return False
+
+            logger.info(f"Using precompiled preamble format: {fmt_file}")
+            return True
+
+    def _fingerprint(self) -> str:
+        """Hash of the preamble, the xelatex version and the relevant TeX files."""
+        digest = hashlib.sha256(self.preamble.encode("utf-8"))
+        version = subprocess.run(
+            ["xelatex", "--version"], capture_output=True, text=True
+        ).stdout
+        digest.update(version.encode("utf-8"))
+        for path in self._kpsewhich(FINGERPRINT_FILES, engine="xetex").splitlines():
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            digest.update(f"{path}:{mtime}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _build(self, jobname: str) -> None:
+        self.format_dir.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            preamble_file = Path(temp_dir) / "preamble.tex"
+            preamble_file.write_text(
+                f"{self.preamble}\n\\begin{{document}}\n\\end{{document}}\n",
+                encoding="utf-8",
+            )
+            logger.info(f"Building preamble format {jobname}...")
+            result = subprocess.run([
+                "xelatex",
+                "-ini",
+                "-interaction=nonstopmode",
+                f"-jobname={jobname}",
+                "&xelatex",
+                "mylatexformat.ltx",
+                preamble_file.name,
+            ], capture_output=True, text=True, cwd=temp_dir)
+
+            built = Path(temp_dir) / f"{jobname}.fmt"
+            if result.returncode != 0 or not built.exists():
+                tail = "\n".join(result.stdout.splitlines()[-10:])
+                raise RuntimeError(tail or "xelatex -ini produced no format")
+
+            # 清理旧版本的格式文件
+            for old in self.format_dir.glob(f"{self.name}-*.fmt"):
+                try:
+                    if time.time() - old.stat().st_mtime > STALE_FORMAT_SECONDS:
+                        old.unlink()
+                except FileNotFoundError:
+                    pass
+            # 先复制到格式目录中的临时文件再原子替换：正在运行的渲染、预热进程
+            # 及其他服务进程可能正在读取同名的旧格式文件
+            staged = self.format_dir / f".{built.name}.tmp"
+            shutil.copyfile(built, staged)
+            os.replace(staged, self.format_dir / built.name)
+
+    def _smoke_test(self) -> bool:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            tex_file = Path(temp_dir) / "smoke.tex"
+            tex_file.write_text(
+                f"{self.preamble}\n\\begin{{document}}\nok\n\\end{{document}}\n",
+                encoding="utf-8",
+            )
+            result = subprocess.run(
+                ["xelatex", *self.xelatex_args(), "-interaction=nonstopmode", tex_file.name],
+                capture_output=True, text=True, cwd=temp_dir, env=self.env(),
+            )
+            return result.returncode == 0 and (Path(temp_dir) / "smoke.pdf").exists()
+
+    @staticmethod
+    def _kpsewhich(names: list[str], engine: str | None = None) -> str:
+        cmd = ["kpsewhich"]
+        if engine:
+            cmd.append(f"-engine={engine}")
+        result = subprocess.run([*cmd, *names], capture_output=True, text=True)
+        return result.stdout.strip()
@@ -0,0 +1,123 @@
+import re
+from collections import deque
+from pathlib import Path
+from typing import NamedTuple
+
+# TeX 默认在 79 个字符处折行（max_print_line）
+MAX_PRINT_LINE = 79
+
+# 错误上下文里的 "l.<行号> <已读入的内容>"
+LINE_CONTEXT = re.compile(r"^l\.(\d+) ?(.*)")
+
+# 缺失文件 / 宏包 / TikZ 库 / 字体的常见报错，以及缺失项名称的格式
+MISSING_PATTERNS = (
+    (re.compile(r"File `([^']+)' not found"), "{}"),
+    (re.compile(r"I can't find file `([^']+)'"), "{}"),
+    (re.compile(r"I did not find the tikz library '([^']+)'"), "tikzlibrary{}.code.tex"),
+    (re.compile(r'The font "([^"]+)" cannot be found'), "{}"),
+)
+
+# 前面已有错误时，这些行只是后果，不单独报告
+FOLLOW_UP_ERRORS = ("! Emergency stop.", "!  ==> Fatal error occurred")
+
+
+class TexError(NamedTuple):
+    """One error from a TeX log."""
+
+    message: str
+    # 用户代码中的行号；错误不在用户代码内时为 None
+    line: int | None = None
+    # "l.<n>" 后 TeX 已读入的那部分源码
+    source: str | None = None
+    # 找不到的文件、宏包、TikZ 库或字体
+    missing: str | None = None
+
+    def describe(self) -> str:
+        text = f"line {self.line}: {self.message}" if self.line else self.message
+        if self.source:
+            text += f"\n    {self.source}"
+        if self.missing:
+            text += f"\n    missing: {self.missing}"
+        return text
+
+    def as_dict(self) -> dict:
+        return {field: value for field, value in self._asdict().items() if value is not None}
+
+
+class LatexCompileError(RuntimeError):
+    """xelatex failed; ``errors`` holds what was recognised in its log."""
+
+    def __init__(self, errors: list[TexError], details: str = ""):
+        self.errors = errors
+        self.details = details
+        summary = "\n".join(error.describe() for error in errors) or details
+        super().__init__(f"LaTeX compilation failed:\n\n{summary}")
+
+
+def parse_log(
+    log_file: Path,
+    line_offset: int = 0,
+    snippet_lines: int | None = None,
+    max_errors: int = 5,
+) -> tuple[list[TexError], str]:
+    """Stream ``log_file`` and return its errors plus the log tail.
+
+    ``l.<n>`` numbers are shifted by ``line_offset`` (the lines preceding the
+    user's snippet in the typeset file); results outside ``1..snippet_lines``
+    are not in the snippet and are dropped. The tail (last non-empty lines)
+    is meant as a fallback when no error was recognised.
+    """
+    errors: list[TexError] = []
+    tail: deque[str] = deque(maxlen=15)
+    current: dict | None = None
+    # 错误信息所在行写满时，下一行是它的续行
+    continues = False
+
+    def finish() -> None:
+        nonlocal current
+        if current is not None:
+            errors.append(TexError(**current))
+            current = None
+
+    with open(log_file, encoding="utf-8", errors="ignore") as log:
+        for raw_line in log:
+            line = raw_line.rstrip("\r\n")
+            if line.strip():
+                tail.append(line.strip())
+
+            if continues:
+                current["message"] += line
+                continues = len(line) >= MAX_PRINT_LINE
+                continue
+
+            if line.startswith("!"):
+                if (errors or current is not None) and line.startswith(FOLLOW_UP_ERRORS):
+                    continue
+                finish()
+                if len(errors) >= max_errors:
+                    break
+                current = {"message": line[1:].strip(), "line": None, "source": None}
+                continues = len(line) >= MAX_PRINT_LINE
+                continue
+
+            if current is None:
+                continue
+            match = LINE_CONTEXT.match(line)
+            if match:
+                line_number = int(match.group(1)) - line_offset
+                if line_number >= 1 and (snippet_lines is None or line_number <= snippet_lines):
+                    current["line"] = line_number
+                current["source"] = match.group(2).strip() or None
+                finish()
+
+    finish()
+    errors = [_with_missing(error) for error in errors]
+    return errors, "\n".join(tail)
+
+
+def _with_missing(error: TexError) -> TexError:
+    for pattern, template in MISSING_PATTERNS:
+        match = pattern.search(error.message)
+        if match:
+            return error._replace(missing=template.format(match.group(1)))
+    return error
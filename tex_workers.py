@@ -0,0 +1,227 @@
+import logging
+import os
+import select
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import sandbox
+from sandbox import SandboxLimits
+from tex_format import PreambleFormat
+
+logger = logging.getLogger(__name__)
+
+READY_MARKER = b"TIKZ-WORKER-READY"
+
+# 预热进程的驱动文件：加载模板后停在 \begin{document} 之后，
+# 从标准输入读到一行后才切换到 nonstopmode 并读取 body.tex。
+DRIVER_TEMPLATE = """{preamble}
+\\begin{{document}}
+\\message{{TIKZ-WORKER-READY}}
+\\read-1 to\\tikzworkergo
+\\nonstopmode
+\\input{{body.tex}}
+\\end{{document}}
+"""
+
+
+class WarmTexWorker:
+    """One xelatex process that has already loaded the preamble and fonts.
+
+    The process sits on a terminal ``\\read`` right after ``\\begin{document}``.
+    ``run()`` writes the diagram body to ``body.tex``, releases the read and
+    waits for the job to finish. xdvipdfmx only writes the PDF when the TeX
+    run ends, so every worker serves exactly one job and is then replaced.
+    """
+
+    def __init__(
+        self,
+        preamble: str,
+        preamble_format: PreambleFormat,
+        limits: SandboxLimits = SandboxLimits(),
+    ):
+        self.limits = limits
+        self.workdir = Path(tempfile.mkdtemp(prefix="tikz-warm-"))
+        self.started_at = time.monotonic()
+        self._ready = False
+        self._output = b""
+
+        driver = self.workdir / "diagram.tex"
+        driver.write_text(DRIVER_TEMPLATE.format(preamble=preamble), encoding="utf-8")
+        # 资源限制覆盖整个进程生命周期（预热 + 一次编译）
+        self.process = sandbox.spawn(
+            [
+                "xelatex",
+                *sandbox.HARDENED_TEX_ARGS,
+                *preamble_format.xelatex_args(),
+                # scrollmode 允许从终端 \read，读到后再切换为 nonstopmode
+                "-interaction=scrollmode",
+                "-halt-on-error",
+                driver.name,
+            ],
+            limits,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=self.workdir,
+            env=sandbox.hardened_env(preamble_format.env()),
+        )
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def poll_ready(self) -> bool:
+        """Drain pending output without blocking and report readiness."""
+        if self._ready:
+            return self.alive
+        if not self.alive:
+            return False
+        fd = self.process.stdout.fileno()
+        while select.select([fd], [], [], 0)[0]:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            # 只保留末尾一段，避免预热输出占用内存
+            self._output = (self._output + chunk)[-4096:]
+        self._ready = READY_MARKER in self._output
+        return self._ready
+
+    def run(self, body: str, timeout: float | None = None) -> int:
+        """Typeset ``body`` and return xelatex's exit code.
+
+        Raises a ``SandboxError`` when the job hits a resource limit.
+        """
+        (self.workdir / "body.tex").write_text(body, encoding="utf-8")
+        sandbox.communicate(self.process, self.limits, input=b"\n", timeout=timeout)
+        return self.process.returncode
+
+    def close(self) -> None:
+        if self.alive:
+            sandbox.kill_group(self.process)
+        try:
+            self.process.communicate(timeout=5)
+        except (subprocess.TimeoutExpired, ValueError):
+            pass
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class WarmTexPool:
+    """Keeps ``size`` pre-warmed xelatex workers ready for wrapped renders.
+
+    ``acquire()`` hands out a ready worker (or None, in which case the caller
+    falls back to a one-shot xelatex run) and immediately starts a
+    replacement. Workers that crashed while idle or have idled longer than
+    ``max_idle`` seconds are restarted by the health check.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        preamble: str,
+        preamble_format: PreambleFormat,
+        max_idle: float = 600.0,
+        limits: SandboxLimits = SandboxLimits(),
+    ):
+        self.size = size
+        self.preamble = preamble
+        self.preamble_format = preamble_format
+        self.limits = limits
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._spares: deque[WarmTexWorker] = deque()
+        self._closed = False
+        # 连续多个进程在预热阶段崩溃时停用，避免反复重启
+        self._consecutive_crashes = 0
+        self._counters = {"jobs": 0, "fallbacks": 0, "restarts": 0}
+
+    def start(self) -> None:
+        if self.size <= 0:
+            return
+        if not shutil.which("xelatex"):
+            logger.warning("xelatex not found, warm TeX workers disabled")
+            self.size = 0
+            return
+        with self._lock:
+            self._fill()
+        logger.info(f"Started {self.size} warm TeX workers")
+
+    def acquire(self) -> WarmTexWorker | None:
+        if self.size <= 0:
+            return None
+        with self._lock:
+            self._check_health()
+            worker = None
+            for candidate in self._spares:
+                if candidate.poll_ready():
+                    worker = candidate
+                    break
+            if worker is None:
+                self._counters["fallbacks"] += 1
+                return None
+            self._consecutive_crashes = 0
+            self._spares.remove(worker)
+            self._counters["jobs"] += 1
+            self._fill()
+            return worker
+
+    def release(self, worker: WarmTexWorker) -> None:
+        worker.close()
+
+    def restart_all(self) -> None:
+        """Replace every idle worker, e.g. after the preamble format changed."""
+        with self._lock:
+            while self._spares:
+                self._spares.popleft().close()
+            self._fill()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = self.size
+            stats["ready"] = sum(1 for worker in self._spares if worker.poll_ready())
+        return stats
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._closed = True
+            while self._spares:
+                self._spares.popleft().close()
+
+    def _check_health(self) -> None:
+        now = time.monotonic()
+        for worker in list(self._spares):
+            if not worker.alive:
+                logger.warning(
+                    f"Warm TeX worker exited unexpectedly (code {worker.process.returncode}), restarting"
+                )
+                if not worker._ready:
+                    self._consecutive_crashes += 1
+            elif now - worker.started_at > self.max_idle:
+                logger.debug("Recycling idle warm TeX worker")
+            else:
+                continue
+            self._spares.remove(worker)
+            worker.close()
+            self._counters["restarts"] += 1
+        if self._consecutive_crashes >= 3:
+            logger.error("Warm TeX workers keep crashing during warm-up, disabling them")
+            self.size = 0
+            while self._spares:
+                self._spares.popleft().close()
+            return
+        self._fill()
+
+    def _fill(self) -> None:
+        while not self._closed and len(self._spares) < self.size:
+            try:
+                self._spares.append(
+                    WarmTexWorker(self.preamble, self.preamble_format, self.limits)
+                )
+            except OSError as e:
+                logger.error(f"Failed to start warm TeX worker: {e}")
+                break
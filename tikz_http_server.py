@@ -1,40 +1,202 @@
 #!/usr/bin/env python3
 
+import shutil
 import subprocess
 import tempfile
+import time
 import base64
+import json
 import logging
 import sys
 import os
-import uuid
+import re
+import mimetypes
 from pathlib import Path
+import asyncio
 import contextlib
 from collections.abc import AsyncIterator
-from datetime import datetime
 
 import click
 import mcp.types as types
+import metrics
+import progress
 from mcp.server.lowlevel import Server
 from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
 from starlette.applications import Starlette
 from starlette.routing import Mount, Route
-from starlette.staticfiles import StaticFiles
-from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.requests import Request
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, JSONResponse, RedirectResponse, Response
 from starlette.types import Receive, Scope, Send
+from sse_starlette.sse import AppStatus
+
+import image_optim
+from image_optim import ImageOptimizer, ImageOptions
+from image_store import ImageStore
+from render_cache import RenderCache, cache_key, normalize_tikz
+from rasterizers import MIME_TYPES, RASTERIZERS, Rasterizer, select_rasterizer
+from render_pool import RenderPool
+from process_locks import DocumentLocks, RenderSlots
+from sandbox import RenderCancelled, SandboxError, SandboxLimits, current_cancellation
+import sandbox
+from tex_format import PreambleFormat
+from tex_log import LatexCompileError, parse_log
+from tex_workers import WarmTexPool
+from single_flight import SingleFlight
+from storage import LocalStorage, Storage, create_storage, public_base_url
+from toolchain import Toolchain
+from package_jobs import PackageInstaller
+from progress import ProgressReporter
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# 默认的 standalone 模板，用于不含 \documentclass 的输入。
+# endofdump 之前的部分会被预编译进格式文件；字体相关的宏包
+# （XeTeX 无法把原生字体写入格式）放在其后，每次编译时加载。
+DEFAULT_PREAMBLE = """\\documentclass[border=2pt]{standalone}
+\\usepackage{tikz}
+\\usepackage{pgfplots}
+\\usepackage{amsmath}
+\\usepackage{amssymb}
+\\usepackage{xcolor}
+\\usetikzlibrary{shapes,arrows,positioning,calc,decorations.pathreplacing,patterns,fit,backgrounds,mindmap,trees,arrows.meta,angles,quotes}
+\\pgfplotsset{compat=1.18}
+\\csname endofdump\\endcsname
+\\usepackage{xeCJK}
+\\usepackage{fontspec}
+"""
+
+# 包装后的文档在用户代码之后的结尾部分
+DOCUMENT_END = "\n\\end{document}\n"
+
+# 批量渲染：每个 tikzbatchitem 环境由 standalone 裁剪为单独的一页。
+# 环境本身是一个 TeX 分组，\tikzset、\pgfplotsset、\newcommand 等局部设置不会带到后面的页
+BATCH_PREAMBLE = """\\newenvironment{tikzbatchitem}{}{}
+\\standaloneconfig{multi=tikzbatchitem}
+"""
+
+# 会修改全局状态（全局赋值、计数器、加载库）的代码，合并编译时会影响后面的图形，
+# 结果也就与单独渲染不同，而二者共用缓存键，因此这类代码在批量渲染中单独编译
+GLOBAL_STATE = re.compile(
+    r"\\(?:global|gdef|xdef|newcounter|setcounter|addtocounter|stepcounter|refstepcounter"
+    r"|usetikzlibrary|usepgfplotslibrary|usepgflibrary|makeatletter)(?![A-Za-z@])"
+)
+
+# 单个 TeX / 转换进程默认的墙钟时限占渲染超时的比例；必须小于渲染超时，
+# 否则总是先触发包含排队时间的渲染超时，客户端收不到具体的资源限制错误
+TEX_WALL_FRACTION = 0.8
+
+# 单次批量渲染允许的最大图形数
+MAX_BATCH_ITEMS = 100
+
+# 支持的输出格式；svg 和 pdf 为矢量格式，不需要转位图
+OUTPUT_FORMATS = {**MIME_TYPES, "svg": "image/svg+xml", "pdf": "application/pdf"}
+VECTOR_FORMATS = ("svg", "pdf")
+
+OUTPUT_FORMAT_SCHEMA = {
+    "type": "string",
+    "enum": list(OUTPUT_FORMATS),
+    "description": "Output format: png, webp or jpeg bitmaps, or vector svg/pdf. Defaults to the server's --image-format.",
+}
+
+INCLUDE_TIMINGS_SCHEMA = {
+    "type": "boolean",
+    "description": "Also return per-stage timings (queue_wait, tex_compile, rasterize, optimize, encode, disk_write) in milliseconds.",
+}
+
+# 位图的目标尺寸；矢量格式忽略这些参数
+IMAGE_SIZE_SCHEMAS = {
+    "dpi": {
+        "type": "integer",
+        "minimum": image_optim.MIN_DPI,
+        "maximum": image_optim.MAX_DPI,
+        "description": "Rasterization resolution for bitmap output. Defaults to the server's --dpi.",
+    },
+    "width": {
+        "type": "integer",
+        "minimum": 1,
+        "maximum": image_optim.MAX_PIXELS,
+        "description": "Target bitmap width in pixels; the aspect ratio is kept. Overrides dpi.",
+    },
+    "height": {
+        "type": "integer",
+        "minimum": 1,
+        "maximum": image_optim.MAX_PIXELS,
+        "description": "Target bitmap height in pixels; the aspect ratio is kept. Overrides dpi.",
+    },
+}
+
+THUMBNAIL_WIDTH_SCHEMA = {
+    "type": "integer",
+    "minimum": image_optim.MIN_THUMBNAIL_WIDTH,
+    "maximum": image_optim.MAX_THUMBNAIL_WIDTH,
+    "description": "Also return the URL of a copy scaled down to this width in pixels (bitmap formats only).",
+}
+
+# 部分 Python 版本的 mimetypes 不认识 webp，/images 需要正确的 Content-Type
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("image/svg+xml", ".svg")
+
+
+def build_latex_document(tikz_code: str, extra_preamble: str = "") -> str:
+    """Wrap a TikZ snippet in the default standalone document."""
+    if '\\documentclass' in tikz_code:
+        return tikz_code
+    return f"""{DEFAULT_PREAMBLE}{extra_preamble}
+\\begin{{document}}
+{tikz_code}{DOCUMENT_END}"""
+
+
+def _check_cancelled() -> None:
+    """Raise ``RenderCancelled`` if the current render job was cancelled."""
+    cancellation = current_cancellation.get()
+    if cancellation is not None:
+        cancellation.check()
+
+
+def _resource_limit_result(index: int, error: SandboxError) -> dict:
+    """Batch result for a snippet that exceeded a sandbox limit."""
+    return {
+        "index": index,
+        "error": f"Resource Limit Exceeded ({error.code}): {error}",
+        "resource_limit": error.as_dict(),
+    }
+
 
 class TikZHTTPServer:
-    def __init__(self):
+    def __init__(
+        self,
+        workers: int | None = None,
+        max_queue: int = 32,
+        render_timeout: float = 120.0,
+        cache_memory_bytes: int = 64 * 1024 * 1024,
+        cache_disk_bytes: int = 1024 * 1024 * 1024,
+        cache_ttl: float = 86400.0,
+        preamble_format: bool = True,
+        warm_workers: int = 2,
+        rasterizer: str = "auto",
+        dpi: int = 300,
+        image_format: str = "png",
+        antialias: bool = True,
+        inline_max_bytes: int = 1024 * 1024,
+        storage: Storage | None = None,
+        sandbox_limits: SandboxLimits | None = None,
+        shared_state_dir: Path | None = None,
+        optimize_images: bool = True,
+        png_colors: int = 256,
+    ):
         self.server = Server("tikz-renderer-http")
         self.server_name = "tikz-renderer-http"
         self.server_version = "0.1.0"
         
-        # 获取公网IP地址
-        self.public_ip = os.getenv('PUBLIC_IP', 'localhost')
-        self.public_port = os.getenv('PUBLIC_PORT', '3000')
+        # 相同文档的并发请求只编译一次，共享结果或错误
+        self.single_flight = SingleFlight()
+
+        # 渲染结果的发布位置及公开 URL；默认使用本地 images/ 目录
+        self.storage = storage or LocalStorage(public_base_url())
         
         # 确保图片存储目录存在
         self.images_dir = Path('./images').expanduser()
@@ -49,173 +211,761 @@ class TikZHTTPServer:
             logger.error(f"无法写入图片目录: {self.images_dir}")
             raise
 
-    def compile_tikz_to_image(self, tikz_code: str) -> tuple[str, str]:
-        return self._compile_tikz(tikz_code, return_base64=True)
+        # 渲染的临时目录放在图片目录下，保证结果能原子地 os.replace 到缓存中
+        # （/tmp 常是另一个文件系统）；以 . 开头，不会被索引或通过 /images 访问
+        self.work_root = self.images_dir / '.work'
+        self.work_root.mkdir(exist_ok=True)
+
+        # 多进程模式下，各服务进程通过 shared_state_dir 中的锁文件共享
+        # 渲染槽位、避免重复编译同一文档，并共享宏包安装任务的状态
+        self.shared_state_dir = shared_state_dir
+        workers = workers or os.cpu_count() or 1
+        self.document_locks = None
+        slots = None
+        if shared_state_dir is not None:
+            self.document_locks = DocumentLocks(shared_state_dir / "documents")
+            slots = RenderSlots(shared_state_dir / "slots", workers)
+
+        # 渲染在线程池中执行，避免阻塞事件循环
+        self.render_pool = RenderPool(
+            workers=workers,
+            max_queue=max_queue,
+            timeout=render_timeout,
+            slots=slots,
+        )
+
+        # 每个 TeX 及转换进程的资源限制，墙钟时限默认略小于渲染超时
+        self.sandbox_limits = sandbox_limits or SandboxLimits(
+            wall_seconds=render_timeout * TEX_WALL_FRACTION
+        )
+        if self.sandbox_limits.wall_seconds >= render_timeout:
+            logger.warning(
+                f"TeX wall time limit ({self.sandbox_limits.wall_seconds:g}s) is not below the "
+                f"render timeout ({render_timeout:g}s); the render timeout will fire first"
+            )
+        for backend in RASTERIZERS.values():
+            backend.limits = self.sandbox_limits
+
+        # 光栅化后的缩放和 PNG 压缩
+        self.optimizer = ImageOptimizer(optimize_images, png_colors, self.sandbox_limits)
+
+        # 启动时探测一次 TeX 工具链，缺少必要组件时直接退出
+        self.toolchain = Toolchain(DEFAULT_PREAMBLE).probe()
+        problems = self.toolchain.problems()
+
+        # PDF 转位图的后端，auto 时按已安装的工具自动选择
+        self.rasterizer_choice = rasterizer
+        self.image_format = image_format
+        self._select_backends()
+        if self.rasterizer is None:
+            problems.append(f"No PDF rasterizer able to produce {image_format} images found.")
+        if problems:
+            raise RuntimeError("TeX toolchain check failed: " + " ".join(problems))
+        self.dpi = dpi
+        self.antialias = antialias
+        # base64 模式下超过该大小的结果改为返回资源链接
+        self.inline_max_bytes = inline_max_bytes
+        if self.rasterizer is not None:
+            logger.info(f"Using {self.rasterizer.name} rasterizer ({image_format}, {dpi} DPI)")
+
+        # 渲染结果缓存：内存 LRU + images/ 目录下按哈希命名的文件
+        # 按哈希前缀分目录存放，SQLite 索引记录大小和访问时间，供增量淘汰使用
+        self.image_store = ImageStore(self.images_dir, max_bytes=cache_disk_bytes, ttl=cache_ttl)
+        self.render_cache = RenderCache(
+            self.image_store,
+            max_memory_bytes=cache_memory_bytes,
+            ttl=cache_ttl,
+        )
+
+        # 预编译默认模板的格式文件，TeX 安装或模板变化时自动重建
+        self.preamble_format = PreambleFormat(DEFAULT_PREAMBLE, Path('./formats'))
+        self.use_preamble_format = preamble_format
+        if preamble_format:
+            self.preamble_format.ensure()
+
+        # 常驻的预热 xelatex 进程，停在 \begin{document} 之后等待图形内容
+        self.warm_pool = WarmTexPool(
+            warm_workers, DEFAULT_PREAMBLE, self.preamble_format, limits=self.sandbox_limits
+        )
+        self.warm_pool.start()
+
+        # 宏包安装在后台单线程执行，完成后刷新格式文件、工具链信息和预热进程
+        self.package_installer = PackageInstaller(
+            on_installed=self.refresh_tex_tree,
+            state_dir=shared_state_dir / "install_jobs" if shared_state_dir else None,
+        )
+
+        self._register_metrics()
+
+    def _register_metrics(self) -> None:
+        """Expose pool, cache and image directory state on /metrics."""
+        def pool_state():
+            stats = self.render_pool.stats()
+            return [({"state": "active"}, stats["active"]), ({"state": "queued"}, stats["queued"])]
+
+        def cache_lookups():
+            stats = self.render_cache.stats()
+            return [
+                ({"result": "memory_hit"}, stats["memory_hits"]),
+                ({"result": "disk_hit"}, stats["disk_hits"]),
+                ({"result": "miss"}, stats["misses"]),
+            ]
+
+        metrics.REGISTRY.callback(
+            "tikz_render_workers", "Renders running or waiting for a worker", "gauge", pool_state
+        )
+        metrics.REGISTRY.callback(
+            "tikz_cache_lookups_total", "Render cache lookups by result", "counter", cache_lookups
+        )
+        metrics.REGISTRY.callback(
+            "tikz_coalesced_requests_total",
+            "Render requests that shared an identical in-flight compilation",
+            "counter",
+            lambda: [({}, self.single_flight.stats()["coalesced"])],
+        )
+        metrics.REGISTRY.callback(
+            "tikz_image_dir_bytes", "Total size of the images directory", "gauge",
+            lambda: [({}, self.image_store.stats()["bytes"])],
+        )
+        metrics.REGISTRY.callback(
+            "tikz_image_dir_files", "Number of files in the images directory", "gauge",
+            lambda: [({}, self.image_store.stats()["files"])],
+        )
+
+    async def evict_images(self, interval: float = 60.0) -> None:
+        """Background task: trim the image store in small batches every ``interval`` seconds."""
+        while True:
+            try:
+                # 每批最多删除 batch_size 个文件，删满一批说明还有剩余，立即继续
+                while await asyncio.to_thread(self.image_store.evict) >= self.image_store.batch_size:
+                    pass
+            except Exception:
+                logger.exception("Image store eviction failed")
+            await asyncio.sleep(interval)
+
+    def compile_tikz_to_image(
+        self,
+        tikz_code: str,
+        output_format: str | None = None,
+        image_options: ImageOptions = ImageOptions(),
+    ) -> tuple[str, str]:
+        return self._compile_tikz(
+            tikz_code, return_base64=True, output_format=output_format, image_options=image_options
+        )
 
-    def compile_tikz_to_url(self, tikz_code: str) -> str:
-        base64_data, file_url = self._compile_tikz(tikz_code, return_base64=False)
+    def compile_tikz_to_url(
+        self,
+        tikz_code: str,
+        output_format: str | None = None,
+        image_options: ImageOptions = ImageOptions(),
+    ) -> str:
+        base64_data, file_url = self._compile_tikz(
+            tikz_code, return_base64=False, output_format=output_format, image_options=image_options
+        )
         return file_url
 
-    def install_tex_package(self, package_name: str) -> str:
-        """Install a TeX package using tlmgr or apt-get."""
-        try:
-            # 首先尝试使用 tlmgr
-            result = subprocess.run([
-                "tlmgr", "install", package_name
-            ], capture_output=True, text=True, timeout=300)
-            
-            if result.returncode == 0:
-                return f"Successfully installed TeX package: {package_name}"
+    def compile_tikz_batch(
+        self,
+        tikz_codes: list[str],
+        output_format: str | None = None,
+        image_options: ImageOptions = ImageOptions(),
+    ) -> list[dict]:
+        """Render several snippets, sharing one multi-page xelatex run.
+
+        Returns one ``{"index", "url"}`` or ``{"index", "error"}`` dict per input.
+        Vector formats are compiled one snippet at a time.
+        """
+        output_format = output_format or self.image_format
+        self._check_output_format(output_format)
+
+        results: list[dict] = [{} for _ in tikz_codes]
+        pending = []
+        for index, tikz_code in enumerate(tikz_codes):
+            snippet, latex_content, key = self._prepare_document(
+                tikz_code, output_format, image_options
+            )
+            entry = self.render_cache.get(key, with_data=False)
+            shared = None if entry is not None else self._fetch_shared(key, return_base64=False)
+            if entry is not None:
+                _, file_url = self._render_result(entry.filename, None, False)
+                results[index] = {"index": index, "url": file_url}
+                progress.report("stored", file_url)
+            elif shared is not None:
+                results[index] = {"index": index, "url": shared[1]}
+            elif (
+                latex_content == snippet
+                or output_format in VECTOR_FORMATS
+                or GLOBAL_STATE.search(snippet)
+            ):
+                # 自带 \documentclass 或修改全局状态的输入不能合并，单独编译
+                results[index] = self._compile_batch_item(
+                    index, tikz_code, output_format, image_options
+                )
             else:
-                # 如果tlmgr不可用，尝试使用apt-get
-                result = subprocess.run([
-                    "apt-get", "update"
-                ], capture_output=True, text=True, timeout=60)
-                
-                if result.returncode == 0:
-                    result = subprocess.run([
-                        "apt-get", "install", "-y", f"texlive-{package_name}"
-                    ], capture_output=True, text=True, timeout=300)
-                    
-                    if result.returncode == 0:
-                        return f"Successfully installed TeX package: texlive-{package_name}"
-                    else:
-                        return f"Failed to install package {package_name} via apt-get: {result.stderr}"
-                else:
-                    return f"Failed to install package {package_name}: {result.stderr}"
-                    
-        except subprocess.TimeoutExpired:
-            return f"Installation timeout for package: {package_name}"
-        except Exception as e:
-            return f"Error installing package {package_name}: {str(e)}"
+                pending.append((index, snippet, key))
 
-    def _compile_tikz(self, tikz_code: str, return_base64: bool) -> tuple[str, str]:
-        """Compile TikZ code to PNG image and return (base64_data, file_url)."""
-        try:
-            subprocess.run(["xelatex", "--version"], check=True, capture_output=True)
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            raise RuntimeError("xelatex not found. Please install TeX Live or MiKTeX.")
+        self._compile_batch_group(pending, results, output_format, image_options)
+        return results
 
-        try:
-            subprocess.run(["convert", "--version"], check=True, capture_output=True)
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            raise RuntimeError("ImageMagick convert not found. Please install ImageMagick.")
+    def cached_render(
+        self,
+        tikz_code: str,
+        return_base64: bool,
+        output_format: str | None = None,
+        image_options: ImageOptions = ImageOptions(),
+    ) -> tuple[str, str] | None:
+        """Return (base64_data, file_url) from the render cache, or None on a miss."""
+        _, _, key = self._prepare_document(
+            tikz_code, output_format or self.image_format, image_options
+        )
+        entry = self.render_cache.get(
+            key, with_data=return_base64, max_data_bytes=self.inline_max_bytes
+        )
+        if entry is None:
+            return None
+        return self._render_result(entry.filename, entry.data, return_base64)
+
+    def flight_key(
+        self,
+        tikz_code: str,
+        output_format: str,
+        mode: str,
+        image_options: ImageOptions = ImageOptions(),
+    ) -> str:
+        """Single-flight key: the document's cache key plus the response mode."""
+        _, _, key = self._prepare_document(tikz_code, output_format, image_options)
+        # base64 和 URL 请求的返回值不同，分别合并
+        return f"{key}:{mode}"
+
+    def thumbnail_url(
+        self,
+        tikz_code: str,
+        output_format: str,
+        image_options: ImageOptions,
+        width: int,
+    ) -> str:
+        """URL of a ``width`` pixel wide copy of an already rendered image.
+
+        The thumbnail is scaled from the stored full-size bitmap, so the PDF
+        is only typeset and rasterized once.
+        """
+        if output_format not in MIME_TYPES:
+            raise RuntimeError("Thumbnails are only available for png, webp and jpeg output")
+        _, _, key = self._prepare_document(tikz_code, output_format, image_options)
+        stem, extension = key.rsplit(".", 1)
+        thumbnail_key = f"{stem}-w{width}.{extension}"
+        entry = self.render_cache.get(thumbnail_key, with_data=False, count_miss=False)
+        if entry is not None:
+            return self._render_result(entry.filename, None, False)[1]
+
+        with self._work_dir() as temp_dir:
+            source = self.render_cache.path_for(key)
+            if not source.exists():
+                # 原图可能已被淘汰，或只存在于共享存储中
+                source = Path(temp_dir) / key
+                if not self.storage.fetch(key, source):
+                    raise RuntimeError("Rendered image is no longer available, please render it again")
+            thumbnail_file = Path(temp_dir) / thumbnail_key
+            with metrics.stage("optimize"):
+                self.optimizer.thumbnail(source, thumbnail_file, output_format, width)
+            return self._store_image(thumbnail_file, thumbnail_key, False, announce=False)[1]
+
+    def _prepare_document(
+        self, tikz_code: str, output_format: str, image_options: ImageOptions = ImageOptions()
+    ) -> tuple[str, str, str]:
+        """Return the snippet to compile, its full LaTeX document and cache key.
+
+        The submitted code is compiled as is; only the cache key is computed
+        from its normalized form. The key doubles as the file name,
+        ``<hash>.<output_format>``.
+        """
+        snippet = tikz_code
+        latex_content = build_latex_document(snippet)
+        normalized = build_latex_document(normalize_tikz(tikz_code))
+        digest = cache_key(normalized, self._render_options(output_format, image_options))
+        return snippet, latex_content, f"{digest}.{output_format}"
+
+    def _render_options(
+        self, output_format: str, image_options: ImageOptions = ImageOptions()
+    ) -> dict:
+        """Render parameters that affect the output, part of the cache key."""
+        if output_format == "pdf":
+            return {"format": "pdf"}
+        if output_format == "svg":
+            return {"format": "svg", "backend": self.svg_backend}
+        rasterizer = self.rasterizers.get(output_format)
+        return {
+            "format": output_format,
+            "dpi": image_options.dpi or self.dpi,
+            "width": image_options.width,
+            "height": image_options.height,
+            "antialias": self.antialias,
+            "rasterizer": rasterizer.name if rasterizer else None,
+            **self.optimizer.cache_options(),
+        }
+
+    def available_output_formats(self) -> list[str]:
+        formats = [fmt for fmt, rasterizer in self.rasterizers.items() if rasterizer]
+        if self.svg_backend is not None:
+            formats.append("svg")
+        return [*formats, "pdf"]
+
+    def _check_output_format(self, output_format: str) -> None:
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(
+                f"Unsupported output format: {output_format}. "
+                f"Supported: {', '.join(OUTPUT_FORMATS)}"
+            )
+        if output_format == "svg" and self.svg_backend is None:
+            raise RuntimeError("SVG output requires dvisvgm or pdftocairo (poppler-utils).")
+        if output_format in MIME_TYPES and self.rasterizers[output_format] is None:
+            raise RuntimeError(
+                f"No PDF rasterizer able to produce {output_format} images found. Please install "
+                "poppler-utils (pdftocairo), mupdf-tools, pypdfium2, PyMuPDF or ImageMagick."
+            )
+
+    def _image_content(
+        self, image_base64: str, file_url: str, output_format: str
+    ) -> types.ContentBlock:
+        """Inline content block for a rendered file."""
+        if output_format == "pdf":
+            return types.EmbeddedResource(
+                type="resource",
+                resource=types.BlobResourceContents(
+                    uri=file_url,
+                    mimeType=OUTPUT_FORMATS["pdf"],
+                    blob=image_base64,
+                ),
+            )
+        return types.ImageContent(
+            type="image",
+            data=image_base64,
+            mimeType=OUTPUT_FORMATS[output_format]
+        )
 
-        with tempfile.TemporaryDirectory() as temp_dir:
-            tex_file = Path(temp_dir) / "diagram.tex"
+    def _resource_link(self, file_url: str, output_format: str) -> types.ResourceLink:
+        """Link to a rendered file that is too large to inline."""
+        return types.ResourceLink(
+            type="resource_link",
+            name=file_url.rsplit("/", 1)[-1],
+            uri=file_url,
+            mimeType=OUTPUT_FORMATS[output_format],
+        )
 
-            if '\\documentclass' in tikz_code:
-                latex_content = tikz_code
+    def _render_result(
+        self, filename: str, data: bytes | None, return_base64: bool
+    ) -> tuple[str, str]:
+        # 生成文件URL
+        file_url = self.storage.public_url(filename)
+
+        # 生成base64数据
+        image_base64 = ""
+        if return_base64 and data is not None:
+            with metrics.stage("encode"):
+                image_base64 = base64.b64encode(data).decode('utf-8')
+
+        return image_base64, file_url
+
+    def _select_backends(self) -> None:
+        """Pick the rasterizers and SVG backend from the installed tools."""
+        selected = select_rasterizer(self.rasterizer_choice, self.image_format)
+        # 按请求指定的其他位图格式：指定的后端不支持时自动选择
+        rasterizers: dict[str, Rasterizer | None] = {}
+        for fmt in MIME_TYPES:
+            if selected is not None and fmt in selected.formats:
+                rasterizers[fmt] = selected
             else:
-                latex_content = f"""\\documentclass[border=2pt]{{standalone}}
-\\usepackage{{xeCJK}}
-\\usepackage{{fontspec}}
-\\usepackage{{tikz}}
-\\usepackage{{pgfplots}}
-\\usepackage{{amsmath}}
-\\usepackage{{amssymb}}
-\\usepackage{{xcolor}}
-\\usetikzlibrary{{shapes,arrows,positioning,calc,decorations.pathreplacing,patterns,fit,backgrounds,mindmap,trees,arrows.meta,angles,quotes}}
-\\pgfplotsset{{compat=1.18}}
+                rasterizers[fmt] = next(
+                    (r for r in RASTERIZERS.values() if fmt in r.formats and r.available()),
+                    None,
+                )
+        # SVG 优先用 dvisvgm 直接转换 XDV，跳过 PDF 阶段
+        svg_backend = next(
+            (tool for tool in ("dvisvgm", "pdftocairo") if self.toolchain.has(tool)), None
+        )
+        # 整体替换，渲染线程读到的总是完整的一组后端
+        self.rasterizer, self.rasterizers, self.svg_backend = selected, rasterizers, svg_backend
 
-\\begin{{document}}
-{tikz_code}
-\\end{{document}}
-"""
+    def refresh_tex_tree(self, package: str) -> None:
+        """Rebuild what depends on the TeX installation after ``package`` was installed."""
+        logger.info(f"Refreshing TeX caches after installing {package}")
+        # 新安装的包可能更新了模板依赖的宏包，重建格式文件
+        if self.use_preamble_format:
+            self.preamble_format.invalidate()
+            self.preamble_format.ensure(rebuild=True)
+        self.toolchain = Toolchain(DEFAULT_PREAMBLE).probe()
+        # 安装可能带来新的转换工具（如 dvisvgm），重新选择后端；后端名称是缓存键的一部分
+        previous = (self.svg_backend, {fmt: r and r.name for fmt, r in self.rasterizers.items()})
+        self._select_backends()
+        current = (self.svg_backend, {fmt: r and r.name for fmt, r in self.rasterizers.items()})
+        if current != previous:
+            logger.info(f"Output backends changed after installing {package}: {current}")
+        # 预热进程加载的是旧的格式和宏包
+        self.warm_pool.restart_all()
+
+    def _compile_tikz(
+        self,
+        tikz_code: str,
+        return_base64: bool,
+        output_format: str | None = None,
+        image_options: ImageOptions = ImageOptions(),
+    ) -> tuple[str, str]:
+        """Compile TikZ code to an image/PDF and return (base64_data, file_url)."""
+        output_format = output_format or self.image_format
+        self._check_output_format(output_format)
+        snippet, latex_content, key = self._prepare_document(
+            tikz_code, output_format, image_options
+        )
+
+        # 其他服务进程正在编译同一文档时等待它完成，随后直接命中缓存
+        lock = contextlib.nullcontext()
+        if self.document_locks is not None:
+            lock = self.document_locks.hold(key, current_cancellation.get())
+        with lock:
+            # 排队期间可能已有相同的渲染完成
+            entry = self.render_cache.get(
+                key,
+                with_data=return_base64,
+                count_miss=False,
+                max_data_bytes=self.inline_max_bytes,
+            )
+            if entry is not None:
+                return self._render_result(entry.filename, entry.data, return_base64)
+
+            shared = self._fetch_shared(key, return_base64)
+            if shared is not None:
+                return shared
+
+            with self._work_dir() as temp_dir:
+                output_file = self._produce_output(
+                    Path(temp_dir), snippet, latex_content, output_format, image_options
+                )
+                return self._store_image(output_file, key, return_base64)
+
+    def _work_dir(self) -> tempfile.TemporaryDirectory:
+        """Temporary directory on the same filesystem as the image store."""
+        return tempfile.TemporaryDirectory(dir=self.work_root)
 
-            tex_file.write_text(latex_content, encoding='utf-8')
+    def _produce_output(
+        self,
+        work_dir: Path,
+        snippet: str,
+        latex_content: str,
+        output_format: str,
+        image_options: ImageOptions = ImageOptions(),
+    ) -> Path:
+        """Typeset the document and convert it to ``output_format`` in ``work_dir``."""
+        output_file = work_dir / f"diagram.{output_format}"
 
+        if output_format == "svg" and self.svg_backend == "dvisvgm":
+            # -no-pdf 只生成 XDV，直接转为 SVG，跳过 PDF 阶段
+            xdv_file = self._typeset(work_dir, snippet, latex_content, no_pdf=True)
+            progress.report("rasterizing")
             try:
-                subprocess.run([
-                    "xelatex",
-                    "-interaction=nonstopmode",
-                    "-output-directory", temp_dir,
-                    str(tex_file)
-                ], check=True, capture_output=True, text=True, cwd=temp_dir)
+                with metrics.stage("rasterize"):
+                    sandbox.run([
+                        "dvisvgm",
+                        "--no-fonts",
+                        "--bbox=papersize",
+                        "--output", output_file.name,
+                        xdv_file.name,
+                    ], self.sandbox_limits, cwd=work_dir)
             except subprocess.CalledProcessError as e:
-                log_file = Path(temp_dir) / "diagram.log"
-                error_details = ""
-                if log_file.exists():
-                    log_content = log_file.read_text(encoding='utf-8', errors='ignore')
-                    lines = log_content.split('\n')
-
-                    error_section = False
-                    error_lines = []
-                    context_lines = []
-
-                    for i, line in enumerate(lines):
-                        line_clean = line.strip()
-
-                        if any(keyword in line.lower() for keyword in ['! ', 'error:', 'undefined', 'missing']):
-                            error_section = True
-                            error_lines.append(line_clean)
-                            for j in range(max(0, i-2), i):
-                                if lines[j].strip() and lines[j].strip() not in context_lines:
-                                    context_lines.append(lines[j].strip())
-                            continue
-
-                        if error_section:
-                            if line_clean:
-                                if line.startswith('l.') or 'line' in line.lower():
-                                    error_lines.append(line_clean)
-                                elif any(char in line for char in ['^', '?']):
-                                    error_lines.append(line_clean)
-                                elif line_clean.startswith('\\') or '\\' in line_clean:
-                                    error_lines.append(line_clean)
-                                elif len(error_lines) < 10:
-                                    error_lines.append(line_clean)
-                            else:
-                                if len(error_lines) > 0:
-                                    break
-
-                    if context_lines or error_lines:
-                        all_lines = context_lines + ['--- Error Details ---'] + error_lines
-                        error_details = '\n'.join(all_lines[:20])
-                    else:
-                        last_lines = [line for line in lines[-50:] if line.strip()]
-                        error_details = '\n'.join(last_lines[-15:])
+                raise RuntimeError(f"SVG conversion failed: {e.stderr.decode('utf-8', errors='ignore')}")
+        else:
+            pdf_file = self._typeset(work_dir, snippet, latex_content)
+            if output_format == "pdf":
+                return pdf_file
+            progress.report("rasterizing")
+            with metrics.stage("rasterize"):
+                if output_format == "svg":
+                    try:
+                        sandbox.run([
+                            "pdftocairo", "-svg", str(pdf_file), str(output_file)
+                        ], self.sandbox_limits)
+                    except subprocess.CalledProcessError as e:
+                        raise RuntimeError(f"SVG conversion failed: {e.stderr.decode('utf-8', errors='ignore')}")
+                else:
+                    self.rasterizers[output_format].rasterize(
+                        pdf_file,
+                        output_file,
+                        dpi=image_optim.raster_dpi(
+                            pdf_file, image_options, self.dpi, self.sandbox_limits
+                        ),
+                        image_format=output_format,
+                        antialias=self.antialias,
+                    )
+
+        if not output_file.exists():
+            raise RuntimeError(f"{output_format.upper()} file was not generated")
+        if output_format in MIME_TYPES:
+            with metrics.stage("optimize"):
+                image_optim.record(self.optimizer.process(output_file, output_format, image_options))
+        return output_file
+
+    def _typeset(
+        self,
+        work_dir: Path,
+        snippet: str,
+        latex_content: str,
+        use_warm_worker: bool = True,
+        no_pdf: bool = False,
+    ) -> Path:
+        """Run xelatex on ``latex_content`` in ``work_dir`` and return the PDF path.
+
+        With ``no_pdf`` xelatex stops at the XDV file, whose path is returned.
+        """
+        tex_file = work_dir / "diagram.tex"
+        tex_file.write_text(latex_content, encoding='utf-8')
+
+        # 自带 \documentclass 的输入不使用预编译格式和预热进程
+        wrapped = '\\documentclass' not in snippet
+        format_args, format_env = [], None
+        if wrapped and self.preamble_format.available:
+            format_args = self.preamble_format.xelatex_args()
+            format_env = self.preamble_format.env()
+        # 禁用 \write18，TeX 只能读写工作目录（及 TeX 安装目录）内的文件
+        format_env = sandbox.hardened_env(format_env)
+        # 预热进程固定输出 PDF，XDV 输出只能走单次编译
+        worker = None
+        if wrapped and use_warm_worker and not no_pdf:
+            worker = self.warm_pool.acquire()
 
-                    if not error_details:
-                        error_details = e.stderr or "LaTeX compilation failed with unknown error"
+        progress.report("compiling")
+        try:
+            with metrics.stage("tex_compile"):
+                if worker is not None:
+                    self._run_warm_worker(worker, snippet, work_dir)
                 else:
-                    error_details = e.stderr or "LaTeX compilation failed - no log file generated"
+                    # openout_any=p 不允许绝对路径，输入和输出都相对于工作目录
+                    sandbox.run([
+                        "xelatex",
+                        *sandbox.HARDENED_TEX_ARGS,
+                        *format_args,
+                        *(["-no-pdf"] if no_pdf else []),
+                        "-interaction=nonstopmode",
+                        # 第一个错误就停止，不再处理后续的连锁错误
+                        "-halt-on-error",
+                        tex_file.name
+                    ], self.sandbox_limits, text=True, cwd=work_dir, env=format_env)
+        except subprocess.CalledProcessError as e:
+            raise self._compile_error(
+                work_dir / "diagram.log", e, snippet, latex_content, from_worker=worker is not None
+            )
+
+        output_file = work_dir / ("diagram.xdv" if no_pdf else "diagram.pdf")
+        if not output_file.exists():
+            raise RuntimeError(f"{output_file.suffix[1:].upper()} file was not generated")
+        return output_file
+
+    def _compile_error(
+        self,
+        log_file: Path,
+        e: subprocess.CalledProcessError,
+        snippet: str,
+        latex_content: str,
+        from_worker: bool,
+    ) -> LatexCompileError:
+        """Turn a failed run's log into a structured error."""
+        if not log_file.exists():
+            return LatexCompileError([], e.stderr or "LaTeX compilation failed - no log file generated")
+        # 预热进程的 l.<n> 指向 body.tex，即用户代码本身；包装的文档从末尾
+        # 定位用户代码，较短的代码可能与模板中的文字重合，不能用 find
+        start = 0
+        if not from_worker and latex_content != snippet:
+            start = len(latex_content) - len(snippet) - len(DOCUMENT_END)
+        errors, tail = parse_log(
+            log_file,
+            line_offset=latex_content.count("\n", 0, start),
+            snippet_lines=snippet.count("\n") + 1,
+        )
+        return LatexCompileError(errors, tail or e.stderr or "LaTeX compilation failed with unknown error")
 
-                raise RuntimeError(f"LaTeX compilation failed:\n\n{error_details}")
+    def _fetch_shared(self, key: str, return_base64: bool) -> tuple[str, str] | None:
+        """Adopt a render another replica already published to shared storage."""
+        with self._work_dir() as temp_dir:
+            fetched = Path(temp_dir) / key
+            if not self.storage.fetch(key, fetched):
+                return None
+            logger.info(f"Using {key} rendered by another replica")
+            return self._store_image(fetched, key, return_base64, upload=False)
 
-            pdf_file = Path(temp_dir) / "diagram.pdf"
-            if not pdf_file.exists():
-                raise RuntimeError("PDF file was not generated")
+    def _store_image(
+        self,
+        image_file: Path,
+        key: str,
+        return_base64: bool,
+        upload: bool = True,
+        announce: bool = True,
+    ) -> tuple[str, str]:
+        # 以内容哈希命名，原子地移动到图片目录
+        saved_image_path = self.render_cache.path_for(key)
+        with metrics.stage("disk_write"):
+            saved_image_path.parent.mkdir(exist_ok=True)
+            os.replace(image_file, saved_image_path)
 
-            # 生成唯一的文件名
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            unique_id = str(uuid.uuid4())[:8]
-            filename = f"tikz_{timestamp}_{unique_id}.png"
-            saved_png_path = self.images_dir / filename
-            
+            # 超过内联上限的文件不读取，调用方改为返回链接
+            inline = return_base64 and saved_image_path.stat().st_size <= self.inline_max_bytes
+            data = saved_image_path.read_bytes() if inline else None
+        if upload:
+            # 通常在后台上传，不影响本次响应；URL 指向对象存储时会等待上传完成
             try:
-                subprocess.run([
-                    "convert",
-                    "-density", "300",
-                    "-quality", "90",
-                    str(pdf_file),
-                    str(saved_png_path)
-                ], check=True, capture_output=True)
-            except subprocess.CalledProcessError as e:
-                raise RuntimeError(f"Image conversion failed: {e}")
-
-            if not saved_png_path.exists():
-                raise RuntimeError("PNG file was not generated")
-
-            # 生成文件URL
-            file_url = f"http://{self.public_ip}:{self.public_port}/images/{filename}"
-            
-            # 生成base64数据
-            image_base64 = ""
-            if return_base64:
-                with open(saved_png_path, "rb") as f:
-                    image_base64 = base64.b64encode(f.read()).decode('utf-8')
-                
-            return image_base64, file_url
+                self.storage.save(key, saved_image_path)
+            except Exception:
+                # 发布失败的文件不进入缓存，否则之后的命中会返回无法访问的 URL
+                saved_image_path.unlink(missing_ok=True)
+                raise
+        self.render_cache.put(key, data)
+        # 文件已可访问，先把 URL 随进度通知发出，不必等待编码完成
+        if announce:
+            progress.report("stored", self.storage.public_url(key))
+
+        return self._render_result(saved_image_path.name, data, return_base64)
+
+    def _compile_batch_item(
+        self,
+        index: int,
+        tikz_code: str,
+        output_format: str,
+        image_options: ImageOptions = ImageOptions(),
+    ) -> dict:
+        _check_cancelled()
+        try:
+            _, file_url = self._compile_tikz(
+                tikz_code,
+                return_base64=False,
+                output_format=output_format,
+                image_options=image_options,
+            )
+            return {"index": index, "url": file_url}
+        except LatexCompileError as e:
+            return {
+                "index": index,
+                "error": str(e),
+                "errors": [error.as_dict() for error in e.errors],
+            }
+        except SandboxError as e:
+            return _resource_limit_result(index, e)
+        except RenderCancelled:
+            raise
+        except Exception as e:
+            return {"index": index, "error": str(e)}
+
+    def _compile_batch_group(
+        self,
+        items: list[tuple[int, str, str]],
+        results: list[dict],
+        output_format: str,
+        image_options: ImageOptions = ImageOptions(),
+    ) -> None:
+        """Compile ``items`` together, bisecting to isolate failing snippets.
+
+        Each item is ``(index, snippet, cache key)``.
+        """
+        if not items:
+            return
+        if len(items) == 1:
+            index, snippet, _ = items[0]
+            results[index] = self._compile_batch_item(index, snippet, output_format, image_options)
+            return
+
+        _check_cancelled()
+        try:
+            file_urls = self._compile_multipage(items, output_format, image_options)
+        except RenderCancelled:
+            raise
+        except SandboxError as e:
+            # 资源超限在每一半上都会重现，二分只会反复启动 xelatex
+            logger.info(f"Batch of {len(items)} diagrams hit a resource limit: {e.code}")
+            for index, _, _ in items:
+                results[index] = _resource_limit_result(index, e)
+            return
+        except Exception as e:
+            logger.info(f"Batch of {len(items)} diagrams failed, bisecting: {e.__class__.__name__}")
+            middle = len(items) // 2
+            self._compile_batch_group(items[:middle], results, output_format, image_options)
+            self._compile_batch_group(items[middle:], results, output_format, image_options)
+            return
+
+        for (index, _, _), file_url in zip(items, file_urls):
+            results[index] = {"index": index, "url": file_url}
+
+    def _compile_multipage(
+        self,
+        items: list[tuple[int, str, str]],
+        output_format: str,
+        image_options: ImageOptions = ImageOptions(),
+    ) -> list[str]:
+        """Typeset all snippets as pages of one document and rasterize each page."""
+        body = "\n".join(
+            f"\\begin{{tikzbatchitem}}\n{snippet}\n\\end{{tikzbatchitem}}"
+            for _, snippet, _ in items
+        )
+        latex_content = build_latex_document(body, extra_preamble=BATCH_PREAMBLE)
+
+        with self._work_dir() as temp_dir:
+            work_dir = Path(temp_dir)
+            pdf_file = self._typeset(work_dir, body, latex_content, use_warm_worker=False)
+
+            # 页数不一致说明某个图形没有恰好生成一页，交给二分处理
+            log_content = (work_dir / "diagram.log").read_text(encoding='utf-8', errors='ignore')
+            match = re.search(r"Output written on .*?\((\d+) pages?", log_content)
+            if match and int(match.group(1)) != len(items):
+                raise RuntimeError(f"Expected {len(items)} pages, got {match.group(1)}")
+
+            image_files = [
+                work_dir / f"page-{page}.{output_format}" for page in range(len(items))
+            ]
+            progress.report("rasterizing")
+            rasterizer = self.rasterizers[output_format]
+            with metrics.stage("rasterize"):
+                # 与单独渲染使用相同的 DPI，结果才能共用同一个缓存键
+                dpis = image_optim.raster_dpis(
+                    pdf_file, image_options, self.dpi, self.sandbox_limits, len(items)
+                )
+                if len(set(dpis)) == 1:
+                    rasterizer.rasterize_pages(
+                        pdf_file,
+                        image_files,
+                        dpi=dpis[0],
+                        image_format=output_format,
+                        antialias=self.antialias,
+                    )
+                else:
+                    for page, (image_file, dpi) in enumerate(zip(image_files, dpis), start=1):
+                        rasterizer.rasterize(
+                            pdf_file,
+                            image_file,
+                            dpi=dpi,
+                            image_format=output_format,
+                            antialias=self.antialias,
+                            page=page,
+                        )
+            with metrics.stage("optimize"):
+                for image_file in image_files:
+                    image_optim.record(
+                        self.optimizer.process(image_file, output_format, image_options)
+                    )
+
+            return [
+                self._store_image(image_file, key, return_base64=False)[1]
+                for image_file, (_, _, key) in zip(image_files, items)
+            ]
+
+    def _run_warm_worker(self, worker, snippet: str, output_dir: Path) -> None:
+        """Typeset ``snippet`` in a warm worker and move its outputs to ``output_dir``."""
+        try:
+            returncode = worker.run(snippet + "\n")
+            for name in ("diagram.pdf", "diagram.log"):
+                produced = worker.workdir / name
+                if produced.exists():
+                    # 预热进程的工作目录在 /tmp 下，可能与输出目录不在同一文件系统
+                    shutil.move(produced, output_dir / name)
+        finally:
+            self.warm_pool.release(worker)
+
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, "xelatex", stderr="")
 
     def setup_handlers(self):
         """Setup MCP tool handlers."""
@@ -225,35 +975,62 @@ class TikZHTTPServer:
             tools = [
                 types.Tool(
                     name="render_tikz_base64",
-                    description="Render TikZ code to high-quality PNG image and return as base64. Supports TikZ diagrams, mathematical plots, flowcharts, and technical illustrations.",
+                    description="Render TikZ code to a high-quality PNG image (or SVG/PDF/WebP/JPEG via output_format) and return as base64. Supports TikZ diagrams, mathematical plots, flowcharts, and technical illustrations.",
                     inputSchema={
                         "type": "object",
                         "properties": {
                             "tikz_code": {
                                 "type": "string",
                                 "description": "TikZ/LaTeX code to render. Can include \\begin{tikzpicture}...\\end{tikzpicture} or full LaTeX document with \\documentclass."
-                            }
+                            },
+                            "output_format": OUTPUT_FORMAT_SCHEMA,
+                            **IMAGE_SIZE_SCHEMAS,
+                            "thumbnail_width": THUMBNAIL_WIDTH_SCHEMA,
+                            "include_timings": INCLUDE_TIMINGS_SCHEMA
                         },
                         "required": ["tikz_code"]
                     }
                 ),
                 types.Tool(
                     name="render_tikz_url",
-                    description="Render TikZ code to high-quality PNG image and return as a URL. Supports TikZ diagrams, mathematical plots, flowcharts, and technical illustrations.",
+                    description="Render TikZ code to a high-quality PNG image (or SVG/PDF/WebP/JPEG via output_format) and return as a URL. Supports TikZ diagrams, mathematical plots, flowcharts, and technical illustrations.",
                     inputSchema={
                         "type": "object",
                         "properties": {
                             "tikz_code": {
                                 "type": "string",
                                 "description": "TikZ/LaTeX code to render. Can include \\begin{tikzpicture}...\\end{tikzpicture} or full LaTeX document with \\documentclass."
-                            }
+                            },
+                            "output_format": OUTPUT_FORMAT_SCHEMA,
+                            **IMAGE_SIZE_SCHEMAS,
+                            "thumbnail_width": THUMBNAIL_WIDTH_SCHEMA,
+                            "include_timings": INCLUDE_TIMINGS_SCHEMA
                         },
                         "required": ["tikz_code"]
                     }
                 ),
+                types.Tool(
+                    name="render_tikz_batch",
+                    description="Render many TikZ snippets in one job and return a URL or an error for each one. Much faster than calling render_tikz_url repeatedly for bulk diagram generation.",
+                    inputSchema={
+                        "type": "object",
+                        "properties": {
+                            "tikz_codes": {
+                                "type": "array",
+                                "items": {"type": "string"},
+                                "maxItems": MAX_BATCH_ITEMS,
+                                "description": "List of TikZ/LaTeX snippets to render, each like the tikz_code argument of render_tikz_url."
+                            },
+                            "output_format": OUTPUT_FORMAT_SCHEMA,
+                            **IMAGE_SIZE_SCHEMAS,
+                            "include_timings": INCLUDE_TIMINGS_SCHEMA
+                        },
+                        "required": ["tikz_codes"]
+                    }
+                ),
                 types.Tool(
                     name="install_tex_package",
-                    description="Install additional TeX packages using tlmgr or apt-get. Useful for adding missing packages needed for TikZ rendering.",
+                    description="Install additional TeX packages using tlmgr or apt-get. Useful for adding missing packages needed for TikZ rendering. Runs in the background and returns a job ID; poll it with get_install_status.",
                     inputSchema={
                         "type": "object",
                         "properties": {
@@ -264,6 +1041,19 @@ class TikZHTTPServer:
                         },
                         "required": ["package_name"]
                     }
+                ),
+                types.Tool(
+                    name="get_install_status",
+                    description="Get the status of a TeX package installation started with install_tex_package (queued, running, installed, already_installed or failed). Without job_id, lists recent installations.",
+                    inputSchema={
+                        "type": "object",
+                        "properties": {
+                            "job_id": {
+                                "type": "string",
+                                "description": "Job ID returned by install_tex_package."
+                            }
+                        }
+                    }
                 )
             ]
             logger.info(f"Listing tools: {[tool.name for tool in tools]}")
@@ -274,6 +1064,80 @@ class TikZHTTPServer:
             name: str, arguments: dict
         ) -> list[types.ContentBlock]:
             logger.info(f"Call tool received: {name}")
+            # 收集本次请求各阶段的耗时，include_timings 为真时随结果返回
+            timings = metrics.track_request()
+            # 位图优化前后的大小，有渲染或缩略图时随结果返回
+            image_stats = image_optim.track_request()
+            started = time.perf_counter()
+            # 客户端带 progressToken 时，按渲染阶段发送进度通知（SSE 模式下随响应流式返回）
+            reporter = ProgressReporter(self.server.request_context)
+            reporter.install()
+
+            def with_timings(content: list[types.ContentBlock]) -> list[types.ContentBlock]:
+                metrics.REQUESTS.inc(tool=name, outcome="success")
+                if image_stats:
+                    content = [
+                        *content,
+                        types.TextContent(type="text", text=json.dumps({"image": image_stats}))
+                    ]
+                if not arguments.get("include_timings"):
+                    return content
+                timings_ms = {stage: round(seconds * 1000, 2) for stage, seconds in timings.items()}
+                timings_ms["total"] = round((time.perf_counter() - started) * 1000, 2)
+                return [
+                    *content,
+                    types.TextContent(type="text", text=json.dumps({"timings_ms": timings_ms}))
+                ]
+
+            def record_error(e: Exception) -> None:
+                metrics.REQUESTS.inc(tool=name, outcome="error")
+                metrics.ERRORS.inc(tool=name, error_class=type(e).__name__)
+
+            def error_content(e: Exception) -> list[types.TextContent]:
+                if isinstance(e, SandboxError):
+                    return [
+                        types.TextContent(
+                            type="text", text=f"Resource Limit Exceeded ({e.code}): {e}"
+                        ),
+                        types.TextContent(
+                            type="text", text=json.dumps({"resource_limit": e.as_dict()})
+                        ),
+                    ]
+                content = [types.TextContent(type="text", text=f"Compilation Error: {e}")]
+                if isinstance(e, LatexCompileError) and e.errors:
+                    # 结构化的错误列表，行号对应提交的 tikz_code
+                    content.append(
+                        types.TextContent(
+                            type="text",
+                            text=json.dumps(
+                                {"errors": [error.as_dict() for error in e.errors]},
+                                ensure_ascii=False,
+                            ),
+                        )
+                    )
+                return content
+
+            output_format = arguments.get("output_format") or self.image_format
+            if output_format not in OUTPUT_FORMATS:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=f"Error: output_format must be one of {', '.join(OUTPUT_FORMATS)}"
+                    )
+                ]
+            try:
+                image_options = ImageOptions.from_arguments(arguments)
+                thumbnail_width = image_optim.thumbnail_width_argument(arguments)
+            except ValueError as e:
+                return [types.TextContent(type="text", text=f"Error: {e}")]
+            if thumbnail_width is not None and output_format not in MIME_TYPES:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=f"Error: thumbnail_width requires one of {', '.join(MIME_TYPES)} output"
+                    )
+                ]
+
             if name == "render_tikz_base64":
                 tikz_code = arguments.get("tikz_code")
 
@@ -286,31 +1150,62 @@ class TikZHTTPServer:
                     ]
 
                 try:
-                    logger.info("Starting TikZ compilation for base64...")
-                    image_base64, file_url = self.compile_tikz_to_image(tikz_code)
+                    # 缓存查询会读 SQLite 索引和磁盘文件，放到线程中执行以免阻塞事件循环
+                    cached = await asyncio.to_thread(
+                        self.cached_render,
+                        tikz_code,
+                        return_base64=True,
+                        output_format=output_format,
+                        image_options=image_options,
+                    )
+                    if cached is not None:
+                        logger.info("Serving TikZ render from cache for base64")
+                        image_base64, file_url = cached
+                    else:
+                        logger.info("Starting TikZ compilation for base64...")
+                        progress.report("queued")
+                        image_base64, file_url = await self.single_flight.do(
+                            self.flight_key(tikz_code, output_format, "base64", image_options),
+                            self.render_pool.run,
+                            self.compile_tikz_to_image,
+                            tikz_code,
+                            output_format,
+                            image_options,
+                        )
+                    if thumbnail_width is not None:
+                        # 缩略图由已保存的原图缩小得到，不再重新编译
+                        image_stats["thumbnail_url"] = await self.render_pool.run(
+                            self.thumbnail_url,
+                            tikz_code,
+                            output_format,
+                            image_options,
+                            thumbnail_width,
+                        )
                     logger.info("TikZ compilation completed successfully for base64")
+                    await reporter.flush()
 
-                    return [
+                    if not image_base64:
+                        return with_timings([
+                            types.TextContent(
+                                type="text",
+                                text=f"TikZ diagram rendered successfully, but it exceeds the "
+                                f"{self.inline_max_bytes} byte inline limit. URL: {file_url}"
+                            ),
+                            self._resource_link(file_url, output_format)
+                        ])
+
+                    return with_timings([
                         types.TextContent(
                             type="text",
                             text="TikZ diagram rendered successfully"
                         ),
-                        types.ImageContent(
-                            type="image",
-                            data=image_base64,
-                            mimeType="image/png"
-                        )
-                    ]
+                        self._image_content(image_base64, file_url, output_format)
+                    ])
 
                 except Exception as e:
-                    error_msg = str(e)
+                    record_error(e)
                     logger.exception("TikZ compilation failed for base64")
-                    return [
-                        types.TextContent(
-                            type="text",
-                            text=f"Compilation Error: {error_msg}"
-                        )
-                    ]
+                    return error_content(e)
 
             elif name == "render_tikz_url":
                 tikz_code = arguments.get("tikz_code")
@@ -324,37 +1219,105 @@ class TikZHTTPServer:
                     ]
 
                 try:
-                    logger.info("Starting TikZ compilation for URL...")
-                    image_base64, file_url = self.compile_tikz_to_image(tikz_code)
+                    # URL 模式只返回链接，不读取文件也不做 base64 编码
+                    cached = await asyncio.to_thread(
+                        self.cached_render,
+                        tikz_code,
+                        return_base64=False,
+                        output_format=output_format,
+                        image_options=image_options,
+                    )
+                    if cached is not None:
+                        logger.info("Serving TikZ render from cache for URL")
+                        _, file_url = cached
+                    else:
+                        logger.info("Starting TikZ compilation for URL...")
+                        progress.report("queued")
+                        file_url = await self.single_flight.do(
+                            self.flight_key(tikz_code, output_format, "url", image_options),
+                            self.render_pool.run,
+                            self.compile_tikz_to_url,
+                            tikz_code,
+                            output_format,
+                            image_options,
+                        )
+                    if thumbnail_width is not None:
+                        # 缩略图由已保存的原图缩小得到，不再重新编译
+                        image_stats["thumbnail_url"] = await self.render_pool.run(
+                            self.thumbnail_url,
+                            tikz_code,
+                            output_format,
+                            image_options,
+                            thumbnail_width,
+                        )
                     logger.info("TikZ compilation completed successfully for URL")
+                    await reporter.flush()
 
-                    return [
+                    return with_timings([
                         types.TextContent(
                             type="text",
                             text=f"TikZ diagram rendered successfully. URL: {file_url}"
-                        ),
-                        types.ImageContent(
-                            type="image",
-                            data=image_base64,
-                            mimeType="image/png"
                         )
-                    ] if image_base64 else [
+                    ])
+
+                except Exception as e:
+                    record_error(e)
+                    logger.exception("TikZ compilation failed for URL")
+                    return error_content(e)
+
+            elif name == "render_tikz_batch":
+                tikz_codes = arguments.get("tikz_codes")
+
+                if (
+                    not tikz_codes
+                    or not isinstance(tikz_codes, list)
+                    or not all(isinstance(code, str) and code for code in tikz_codes)
+                ):
+                    return [
                         types.TextContent(
                             type="text",
-                            text=f"TikZ diagram rendered successfully. URL: {file_url}"
+                            text="Error: A non-empty list of TikZ code strings is required"
                         )
                     ]
-
-                except Exception as e:
-                    error_msg = str(e)
-                    logger.exception("TikZ compilation failed for URL")
+                if len(tikz_codes) > MAX_BATCH_ITEMS:
                     return [
                         types.TextContent(
                             type="text",
-                            text=f"Compilation Error: {error_msg}"
+                            text=f"Error: At most {MAX_BATCH_ITEMS} diagrams per batch"
                         )
                     ]
 
+                try:
+                    logger.info(f"Starting TikZ batch compilation of {len(tikz_codes)} diagrams...")
+                    reporter.items = len(tikz_codes)
+                    progress.report("queued")
+                    results = await self.render_pool.run(
+                        self.compile_tikz_batch,
+                        tikz_codes,
+                        output_format,
+                        image_options,
+                        timeout=self.render_pool.timeout * len(tikz_codes),
+                    )
+                    succeeded = sum(1 for result in results if "url" in result)
+                    logger.info(f"TikZ batch compilation completed: {succeeded}/{len(results)} succeeded")
+                    await reporter.flush()
+
+                    return with_timings([
+                        types.TextContent(
+                            type="text",
+                            text=f"Rendered {succeeded}/{len(results)} TikZ diagrams"
+                        ),
+                        types.TextContent(
+                            type="text",
+                            text=json.dumps({"results": results}, ensure_ascii=False)
+                        )
+                    ])
+
+                except Exception as e:
+                    record_error(e)
+                    logger.exception("TikZ batch compilation failed")
+                    return error_content(e)
+
             elif name == "install_tex_package":
                 package_name = arguments.get("package_name")
 
@@ -367,70 +1330,183 @@ class TikZHTTPServer:
                     ]
 
                 try:
-                    logger.info(f"Starting installation of TeX package: {package_name}")
-                    result = self.install_tex_package(package_name)
-                    logger.info(f"TeX package installation completed: {package_name}")
-
+                    job, created = self.package_installer.submit(package_name)
+                except ValueError as e:
                     return [
                         types.TextContent(
                             type="text",
-                            text=result
+                            text=f"Installation Error: {e}"
                         )
                     ]
 
-                except Exception as e:
-                    error_msg = str(e)
-                    logger.exception("TeX package installation failed")
+                if created:
+                    logger.info(f"Queued installation of TeX package: {package_name} (job {job.id})")
+                    text = f"Installation of {package_name} started. Job ID: {job.id}"
+                else:
+                    text = f"Installation of {package_name} is already in progress. Job ID: {job.id}"
+                return [
+                    types.TextContent(type="text", text=text),
+                    types.TextContent(type="text", text=json.dumps(job.as_dict()))
+                ]
+
+            elif name == "get_install_status":
+                job_id = arguments.get("job_id")
+
+                if job_id:
+                    job = self.package_installer.get(job_id)
+                    if job is None:
+                        return [
+                            types.TextContent(
+                                type="text",
+                                text=f"Error: Unknown installation job: {job_id}"
+                            )
+                        ]
                     return [
                         types.TextContent(
                             type="text",
-                            text=f"Installation Error: {error_msg}"
-                        )
+                            text=f"Installation of {job.package}: {job.status}. {job.message}".strip()
+                        ),
+                        types.TextContent(type="text", text=json.dumps(job.as_dict()))
                     ]
 
+                jobs = [job.as_dict() for job in self.package_installer.recent()]
+                return [
+                    types.TextContent(type="text", text=json.dumps({"jobs": jobs}))
+                ]
+
             else:
                 return [
                     types.TextContent(
                         type="text",
-                        text=f"Unknown tool: {name}. Available tools: render_tikz_base64, render_tikz_url, install_tex_package"
+                        text=f"Unknown tool: {name}. Available tools: render_tikz_base64, render_tikz_url, render_tikz_batch, install_tex_package, get_install_status"
                     )
                 ]
 
 
-@click.command()
-@click.option("--port", default=3000, help="Port to listen on for HTTP")
-@click.option(
-    "--log-level",
-    default="INFO",
-    help="Logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)",
-)
-@click.option(
-    "--json-response",
-    is_flag=True,
-    default=False,
-    help="Enable JSON responses instead of SSE streams",
-)
-def main(
-    port: int,
-    log_level: str,
-    json_response: bool,
-) -> int:
-    """Start the TikZ HTTP MCP server."""
+class ImmutableStaticFiles(StaticFiles):
+    """Serves content-addressed files with strong ETags and long-lived caching.
+
+    Rendered files are named after the hash of their inputs, so a URL never
+    changes content: the file name is a stable ETag (the default one is
+    derived from the mtime, which the render cache touches on every hit) and
+    clients may cache it forever. Range requests are handled by FileResponse.
+    URLs stay flat (``/images/<name>``) and map to the store's shard directory.
+    Files missing locally are redirected to ``fallback(name)`` when it
+    returns a URL, e.g. the shared object store of a multi-replica setup.
+    """
+
+    def __init__(self, *args, fallback=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fallback = fallback
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        # 隐藏的索引和渲染临时目录不对外提供
+        if any(part.startswith(".") for part in Path(path).parts):
+            raise HTTPException(status_code=404)
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as e:
+            if e.status_code != 404 or self.fallback is None:
+                raise
+            url = self.fallback(os.path.basename(path))
+            if url is None:
+                raise
+            return RedirectResponse(url, status_code=307)
+
+    def get_path(self, scope: Scope) -> str:
+        path = super().get_path(scope)
+        if os.sep not in path:
+            path = os.path.join(path[:2], path)
+        return path
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        response.headers["etag"] = f'"{Path(full_path).stem}"'
+        response.headers["cache-control"] = "public, max-age=31536000, immutable"
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+# 多进程模式下，工作进程从该环境变量读取启动参数（JSON）
+CONFIG_ENV = "TIKZ_SERVER_CONFIG"
+
+# 多进程模式下各服务进程共享的锁文件和任务状态
+SHARED_STATE_DIR = Path('./shared')
+
+
+def create_app(config: dict | None = None) -> Starlette:
+    """Build the ASGI application from the CLI options in ``config``.
+
+    Called once per server process. Without ``config`` (uvicorn's factory
+    mode, used for ``--processes``) the options are read from the
+    ``TIKZ_SERVER_CONFIG`` environment variable set by ``main()``.
+    """
+    if config is None:
+        config = json.loads(os.environ[CONFIG_ENV])
+
     # Configure logging
     logging.basicConfig(
-        level=getattr(logging, log_level.upper()),
+        level=getattr(logging, config["log_level"].upper()),
         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     )
 
+    s3_options = {}
+    if config["storage_backend"] == "s3":
+        s3_options = {
+            "bucket": config["s3_bucket"],
+            "prefix": config["s3_prefix"],
+            "endpoint_url": config["s3_endpoint_url"],
+            "region": config["s3_region"],
+            "public_url": config["s3_public_url"],
+        }
+    storage = create_storage(config["storage_backend"], **s3_options)
+
     # Create server instance
-    tikz_server = TikZHTTPServer()
+    tikz_server = TikZHTTPServer(
+        workers=config["workers"],
+        max_queue=config["max_queue"],
+        render_timeout=config["render_timeout"],
+        cache_memory_bytes=config["cache_memory_mb"] * 1024 * 1024,
+        cache_disk_bytes=config["cache_disk_mb"] * 1024 * 1024,
+        cache_ttl=config["cache_ttl"],
+        preamble_format=config["preamble_format"],
+        warm_workers=config["warm_workers"],
+        rasterizer=config["rasterizer"],
+        dpi=config["dpi"],
+        image_format=config["image_format"],
+        antialias=config["antialias"],
+        inline_max_bytes=config["inline_max_kb"] * 1024,
+        sandbox_limits=SandboxLimits(
+            cpu_seconds=config["tex_cpu_seconds"],
+            memory_bytes=config["tex_memory_mb"] * 1024 * 1024,
+            file_size_bytes=config["tex_output_mb"] * 1024 * 1024,
+            max_processes=config["tex_max_processes"],
+            wall_seconds=config["tex_wall_seconds"]
+            or config["render_timeout"] * TEX_WALL_FRACTION,
+        ),
+        storage=storage,
+        shared_state_dir=SHARED_STATE_DIR if config["processes"] > 1 else None,
+        optimize_images=config["optimize"],
+        png_colors=config["png_colors"],
+    )
     tikz_server.setup_handlers()
 
+    # sse-starlette 默认在收到 SIGTERM 时立即关闭所有 SSE 流，会中断进行中的渲染；
+    # 改为由 uvicorn 的优雅关闭等待这些请求完成
+    AppStatus.disable_automatic_graceful_drain()
+
     # Create the session manager (stateless mode for simplicity)
     session_manager = StreamableHTTPSessionManager(
         app=tikz_server.server,
         event_store=None,  # Stateless mode
-        json_response=json_response,
+        json_response=config["json_response"],
         stateless=True,
     )
 
@@ -440,31 +1516,288 @@ def main(
     ) -> None:
         await session_manager.handle_request(scope, receive, send)
 
+    async def handle_health(request: Request) -> JSONResponse:
+        problems = tikz_server.toolchain.problems()
+        return JSONResponse({
+            "status": "error" if problems else "ok",
+            "version": tikz_server.server_version,
+            "problems": problems,
+            "capabilities": tikz_server.toolchain.as_dict(),
+            "output_formats": tikz_server.available_output_formats(),
+        }, status_code=503 if problems else 200)
+
+    async def handle_metrics(request: Request) -> Response:
+        return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+    async def handle_stats(request: Request) -> JSONResponse:
+        return JSONResponse({
+            "render_pool": tikz_server.render_pool.stats(),
+            "render_cache": tikz_server.render_cache.stats(),
+            "warm_workers": tikz_server.warm_pool.stats(),
+            "storage": tikz_server.storage.stats(),
+            "single_flight": tikz_server.single_flight.stats(),
+            "package_jobs": tikz_server.package_installer.stats(),
+        })
+
     @contextlib.asynccontextmanager
     async def lifespan(app: Starlette) -> AsyncIterator[None]:
         """Context manager for managing session manager lifecycle."""
         async with session_manager.run():
+            eviction_task = asyncio.create_task(tikz_server.evict_images())
             logger.info("TikZ HTTP MCP server started!")
             try:
                 yield
             finally:
+                # uvicorn 已等待进行中的请求结束（或超过 --graceful-timeout），
+                # 再等脱离请求继续运行的渲染完成，然后关闭剩余的 SSE 流
                 logger.info("TikZ HTTP MCP server shutting down...")
+                eviction_task.cancel()
+                await asyncio.to_thread(tikz_server.render_pool.shutdown)
+                AppStatus.should_exit = True
+                tikz_server.package_installer.shutdown()
+                tikz_server.warm_pool.shutdown()
+                tikz_server.image_store.close()
+                await asyncio.to_thread(tikz_server.storage.close)
 
     # Create an ASGI application
     starlette_app = Starlette(
-        debug=True,
+        debug=config["debug"],
         routes=[
             Mount("/mcp", app=handle_streamable_http),
-            Mount("/images", app=StaticFiles(directory=tikz_server.images_dir)),
+            Route("/health", endpoint=handle_health),
+            Route("/stats", endpoint=handle_stats),
+            Route("/metrics", endpoint=handle_metrics),
+            Mount("/images", app=ImmutableStaticFiles(
+                directory=tikz_server.images_dir,
+                fallback=tikz_server.storage.redirect_url,
+            )),
         ],
         lifespan=lifespan,
     )
 
+    return starlette_app
+
+
+@click.command()
+@click.option("--port", default=3000, help="Port to listen on for HTTP")
+@click.option(
+    "--log-level",
+    default="INFO",
+    help="Logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)",
+)
+@click.option(
+    "--json-response",
+    is_flag=True,
+    default=False,
+    help="Enable JSON responses instead of SSE streams",
+)
+@click.option(
+    "--workers",
+    default=None,
+    type=int,
+    help="Number of concurrent render workers (default: CPU count), shared by all --processes",
+)
+@click.option(
+    "--max-queue",
+    default=32,
+    help="Maximum number of renders waiting for a free worker",
+)
+@click.option(
+    "--render-timeout",
+    default=120.0,
+    help="Per-request render timeout in seconds",
+)
+@click.option(
+    "--cache-memory-mb",
+    default=64,
+    help="Size of the in-memory render cache in MB",
+)
+@click.option(
+    "--cache-disk-mb",
+    default=1024,
+    help="Maximum size of cached images on disk in MB",
+)
+@click.option(
+    "--cache-ttl",
+    default=86400.0,
+    help="Maximum age of cached renders in seconds",
+)
+@click.option(
+    "--preamble-format/--no-preamble-format",
+    default=True,
+    help="Precompile the default preamble into a TeX format at startup",
+)
+@click.option(
+    "--warm-workers",
+    default=2,
+    help="Number of pre-warmed xelatex processes kept ready (0 to disable)",
+)
+@click.option(
+    "--rasterizer",
+    default="auto",
+    type=click.Choice(["auto", *RASTERIZERS]),
+    help="PDF to image backend (auto picks the first installed one)",
+)
+@click.option(
+    "--dpi",
+    default=300,
+    help="Resolution of rendered images",
+)
+@click.option(
+    "--image-format",
+    default="png",
+    type=click.Choice(list(MIME_TYPES)),
+    help="Image format of rendered diagrams",
+)
+@click.option(
+    "--antialias/--no-antialias",
+    default=True,
+    help="Antialias text and lines when rasterizing",
+)
+@click.option(
+    "--optimize/--no-optimize",
+    default=True,
+    help="Recompress PNG output (palette for line art, zlib/oxipng) before storing it",
+)
+@click.option(
+    "--png-colors",
+    default=256,
+    type=click.IntRange(0, 256),
+    help="Palette size for quantizing line art with many colours (0: lossless palettes only)",
+)
+@click.option(
+    "--storage",
+    "storage_backend",
+    default="local",
+    envvar="STORAGE_BACKEND",
+    type=click.Choice(["local", "s3"]),
+    help="Where rendered files are published: local images/ directory or an S3-compatible bucket",
+)
+@click.option("--s3-bucket", envvar="S3_BUCKET", default=None, help="Bucket for --storage s3")
+@click.option("--s3-prefix", envvar="S3_PREFIX", default="", help="Object key prefix, e.g. 'tikz/'")
+@click.option(
+    "--s3-endpoint-url",
+    envvar="S3_ENDPOINT_URL",
+    default=None,
+    help="Endpoint of an S3-compatible store such as MinIO (default: AWS)",
+)
+@click.option("--s3-region", envvar="S3_REGION", default=None, help="Bucket region")
+@click.option(
+    "--s3-public-url",
+    envvar="S3_PUBLIC_URL",
+    default=None,
+    help="Public base URL of the bucket or its CDN; if unset, URLs go through /images",
+)
+@click.option(
+    "--inline-max-kb",
+    default=1024,
+    help="Largest render returned inline as base64; bigger ones are returned as a resource link",
+)
+@click.option(
+    "--tex-cpu-seconds",
+    default=60,
+    help="CPU time limit of each TeX or conversion process",
+)
+@click.option(
+    "--tex-memory-mb",
+    default=2048,
+    help="Address space limit of each TeX or conversion process",
+)
+@click.option(
+    "--tex-output-mb",
+    default=256,
+    help="Largest file a TeX or conversion process may write",
+)
+@click.option(
+    "--tex-wall-seconds",
+    default=None,
+    type=float,
+    help="Wall-clock limit of each TeX or conversion process (default: 80% of --render-timeout)",
+)
+@click.option(
+    "--tex-max-processes",
+    default=512,
+    help="Process limit (RLIMIT_NPROC, counted per user) for TeX and conversion processes",
+)
+@click.option(
+    "--processes",
+    default=1,
+    envvar="SERVER_PROCESSES",
+    help="Number of server processes; they share the render slots (--workers), cache and install jobs",
+)
+@click.option(
+    "--graceful-timeout",
+    default=None,
+    type=int,
+    help="Seconds to wait for in-flight requests after SIGTERM (default: render timeout + 10)",
+)
+@click.option(
+    "--debug",
+    is_flag=True,
+    default=False,
+    help="Enable Starlette debug mode (tracebacks in HTTP error responses)",
+)
+def main(
+    port: int,
+    log_level: str,
+    json_response: bool,
+    workers: int | None,
+    max_queue: int,
+    render_timeout: float,
+    cache_memory_mb: int,
+    cache_disk_mb: int,
+    cache_ttl: float,
+    preamble_format: bool,
+    warm_workers: int,
+    rasterizer: str,
+    dpi: int,
+    image_format: str,
+    antialias: bool,
+    optimize: bool,
+    png_colors: int,
+    inline_max_kb: int,
+    tex_cpu_seconds: int,
+    tex_memory_mb: int,
+    tex_output_mb: int,
+    tex_wall_seconds: float | None,
+    tex_max_processes: int,
+    storage_backend: str,
+    s3_bucket: str | None,
+    s3_prefix: str,
+    s3_endpoint_url: str | None,
+    s3_region: str | None,
+    s3_public_url: str | None,
+    processes: int,
+    graceful_timeout: int | None,
+    debug: bool,
+) -> int:
+    """Start the TikZ HTTP MCP server."""
     import uvicorn
-    uvicorn.run(starlette_app, host="0.0.0.0", port=port)
+
+    config = click.get_current_context().params
+    if graceful_timeout is None:
+        graceful_timeout = int(render_timeout) + 10
+    # SIGTERM 后停止接受新连接，等待进行中的请求完成后再退出
+    server_options = {
+        "host": "0.0.0.0",
+        "port": port,
+        "timeout_graceful_shutdown": graceful_timeout,
+    }
+
+    if processes > 1:
+        # 每个工作进程通过工厂函数各自创建应用，启动参数经环境变量传递
+        os.environ[CONFIG_ENV] = json.dumps(config)
+        uvicorn.run(
+            "tikz_http_server:create_app",
+            factory=True,
+            workers=processes,
+            **server_options,
+        )
+    else:
+        uvicorn.run(create_app(config), **server_options)
 
     return 0
 
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
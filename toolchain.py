@@ -0,0 +1,122 @@
+import logging
+import os
+import re
+import shutil
+import subprocess
+import time
+
+from rasterizers import RASTERIZERS
+
+logger = logging.getLogger(__name__)
+
+# TeX 引擎；渲染只用 xelatex，其余仅作记录
+ENGINES = ("xelatex", "pdflatex", "lualatex")
+
+# 辅助工具及其打印版本号的参数
+TOOLS = {
+    "kpsewhich": ["--version"],
+    "tlmgr": ["--version"],
+    "dvisvgm": ["--version"],
+    "pdftocairo": ["-v"],
+    "mutool": ["-v"],
+    "convert": ["--version"],
+}
+
+
+def preamble_dependencies(preamble: str) -> tuple[list[str], list[str]]:
+    """Return the (class/package files, tikz libraries) a preamble loads."""
+    files = []
+    for command, names in re.findall(r"\\(documentclass|usepackage)(?:\[[^\]]*\])?\{([^}]*)\}", preamble):
+        suffix = ".cls" if command == "documentclass" else ".sty"
+        files += [f"{name.strip()}{suffix}" for name in names.split(",") if name.strip()]
+    libraries = []
+    for names in re.findall(r"\\usetikzlibrary\{([^}]*)\}", preamble):
+        libraries += [name.strip() for name in names.split(",") if name.strip()]
+    return files, libraries
+
+
+class Toolchain:
+    """Versions and capabilities of the installed TeX and conversion tools.
+
+    ``probe()`` runs once at startup (and again after packages are
+    installed) so renders never spawn processes just to check for a tool.
+    """
+
+    def __init__(self, preamble: str, extra_files: tuple[str, ...] = ("mylatexformat.ltx",)):
+        self.required_files, self.tikz_libraries = preamble_dependencies(preamble)
+        self.extra_files = list(extra_files)
+        self.engines: dict[str, str | None] = {}
+        self.tools: dict[str, str | None] = {}
+        self.rasterizers: list[str] = []
+        self.tex_files: dict[str, str | None] = {}
+        self.libraries: dict[str, bool] = {}
+        self.probed_at: float | None = None
+
+    def probe(self) -> "Toolchain":
+        start = time.perf_counter()
+        self.engines = {name: self._version([name, "--version"]) for name in ENGINES}
+        self.tools = {name: self._version([name, *args]) for name, args in TOOLS.items()}
+        self.rasterizers = [name for name, backend in RASTERIZERS.items() if backend.available()]
+
+        library_files = [f"tikzlibrary{name}.code.tex" for name in self.tikz_libraries]
+        found = self._locate([*self.required_files, *self.extra_files, *library_files])
+        self.tex_files = {name: found.get(name) for name in [*self.required_files, *self.extra_files]}
+        self.libraries = {
+            name: f"tikzlibrary{name}.code.tex" in found for name in self.tikz_libraries
+        }
+        self.probed_at = time.time()
+        logger.info(
+            f"Probed TeX toolchain in {time.perf_counter() - start:.2f}s: "
+            f"engines={[name for name, version in self.engines.items() if version]}, "
+            f"rasterizers={self.rasterizers}"
+        )
+        return self
+
+    def has(self, tool: str) -> bool:
+        return bool(self.engines.get(tool) or self.tools.get(tool))
+
+    def problems(self) -> list[str]:
+        """Missing pieces that make the default renders fail."""
+        problems = []
+        if not self.engines.get("xelatex"):
+            problems.append("xelatex not found. Please install TeX Live or MiKTeX.")
+        if self.tools.get("kpsewhich"):
+            missing = [name for name in self.required_files if not self.tex_files.get(name)]
+            if missing:
+                problems.append(f"Missing TeX packages: {', '.join(missing)}")
+            libraries = [name for name, found in self.libraries.items() if not found]
+            if libraries:
+                problems.append(f"Missing TikZ libraries: {', '.join(libraries)}")
+        return problems
+
+    def as_dict(self) -> dict:
+        return {
+            "engines": self.engines,
+            "tools": self.tools,
+            "rasterizers": self.rasterizers,
+            "tex_files": self.tex_files,
+            "tikz_libraries": self.libraries,
+            "probed_at": self.probed_at,
+        }
+
+    @staticmethod
+    def _version(cmd: list[str]) -> str | None:
+        """First line of the tool's version output, or None if it is missing."""
+        if shutil.which(cmd[0]) is None:
+            return None
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        output = (result.stdout or result.stderr).strip()
+        # 部分工具（如 pdftocairo -v）即使正常也返回非零，只要有输出即可
+        return output.splitlines()[0] if output else shutil.which(cmd[0])
+
+    def _locate(self, names: list[str]) -> dict[str, str]:
+        """Map TeX file names to their paths with a single kpsewhich call."""
+        if not self.tools.get("kpsewhich") or not names:
+            return {}
+        result = subprocess.run(
+            ["kpsewhich", "-engine=xetex", *names], capture_output=True, text=True, timeout=60
+        )
+        return {os.path.basename(path): path for path in result.stdout.splitlines() if path}